@@ -0,0 +1,134 @@
+"""
+Benchmarks of the planner entry points (asv style: time_* and peakmem_*
+methods, run them with asv or with python -m benchmarks.run).
+"""
+import os
+import tempfile
+import pathlib as pl
+import productomator.worker as prodwork
+import productomator.lab as prodlab
+
+from . import synthetic
+
+
+def bench_dir():
+    """Folder for the synthetic archives, they are reused between runs."""
+    return pl.Path(os.environ.get('PRODUCTOMATOR_BENCH_DIR', pl.Path(tempfile.gettempdir()) / 'productomator_bench'))
+
+
+def get_archive(n_files, layout, files_per_day = 1):
+    files_per_day = synthetic.effective_files_per_day(n_files, files_per_day)
+    root = bench_dir() / f'archive_{layout}_{n_files}_{files_per_day}'
+    marker = root / 'complete'
+    if not marker.is_file():
+        synthetic.make_archive(root, n_files = n_files, layout = layout, files_per_day = files_per_day)
+        marker.touch()
+    return synthetic.archive_kwargs(root, layout)
+
+
+def get_database(n_files):
+    path2database = bench_dir() / f'database_{n_files}.sqlite'
+    if not path2database.is_file():
+        return synthetic.make_database(path2database, n_files = n_files)
+    return (str(path2database), 'product', 'row_timestamp', 'input_file')
+
+
+def planner(cls = prodwork.Workplanner, **kwargs):
+    return cls(reporter = prodlab.Reporter(log_folder = None, verbose = False), **kwargs)
+
+
+class Masterplan:
+    params = ([10000, 100000], ['flat', 'yearly'], [False, True])
+    param_names = ['n_files', 'layout', 'compact']
+    timeout = 3600
+
+    def setup(self, n_files, layout, compact):
+        self.kwargs = get_archive(n_files, layout)
+        self.kwargs['compact_masterplan'] = compact
+
+    def time_make_master(self, n_files, layout, compact):
+        planner(**self.kwargs)._make_master()
+
+    def peakmem_make_master(self, n_files, layout, compact):
+        planner(**self.kwargs)._make_master()
+
+    def time_make_master_date_from_name(self, n_files, layout, compact):
+        kwargs = dict(self.kwargs, date_regex = None, date_format = None,
+                      date_from_name = lambda name: name.split('_')[-1].split('.')[0])
+        planner(**kwargs)._make_master()
+
+
+class Workplan:
+    params = ([10000, 100000], ['flat', 'yearly'], ['scandir', 'stat'])
+    param_names = ['n_files', 'layout', 'existence_engine']
+    timeout = 3600
+
+    def setup(self, n_files, layout, existence_engine):
+        self.planner = planner(existence_engine = existence_engine, **get_archive(n_files, layout))
+        self.planner.masterplan
+
+    def time_workplan(self, n_files, layout, existence_engine):
+        self.planner._workplan = None
+        self.planner.workplan
+
+    def time_iter_workplan(self, n_files, layout, existence_engine):
+        for row in self.planner.iter_workplan():
+            pass
+
+    def peakmem_iter_workplan(self, n_files, layout, existence_engine):
+        for row in self.planner.iter_workplan():
+            pass
+
+
+class WorkplanDaily:
+    params = ([10000, 100000], [24, 288])
+    param_names = ['n_files', 'files_per_day']
+    timeout = 3600
+
+    def setup(self, n_files, files_per_day):
+        self.kwargs = get_archive(n_files, 'yearly', files_per_day = files_per_day)
+
+    def time_workplan(self, n_files, files_per_day):
+        planner(cls = prodwork.WorkplannerDaily, **self.kwargs).workplan
+
+    def peakmem_workplan(self, n_files, files_per_day):
+        planner(cls = prodwork.WorkplannerDaily, **self.kwargs).workplan
+
+
+class FilesBetween:
+    params = ([10000, 100000], ['flat', 'yearly'], ['glob', 'scan'])
+    param_names = ['n_files', 'layout', 'method']
+    timeout = 3600
+    # one glob per day lists the whole folder, i.e. the time grows with days times files per folder
+    max_files_glob = {'flat': 2000, 'yearly': 10000}
+
+    def setup(self, n_files, layout, method):
+        if method == 'glob' and n_files > self.max_files_glob[layout]:
+            raise NotImplementedError(f'glob on the {layout} layout is too slow for more than {self.max_files_glob[layout]} files')
+        self.kwargs = get_archive(n_files, layout)
+        dates = synthetic.archive_dates(n_files)
+        self.start = dates[0]
+        self.end = dates[-1]
+
+    def time_files_between(self, n_files, layout, method):
+        for p2f in prodwork.files_between(pl.Path(self.kwargs['p2fld_in']), self.start, self.end, '*.nc',
+                                          input_directory_structure = layout, method = method):
+            pass
+
+
+class Database:
+    params = ([10000, 100000],)
+    param_names = ['n_files']
+    timeout = 3600
+
+    def setup(self, n_files):
+        self.kwargs = get_archive(n_files, 'yearly')
+        self.kwargs.pop('p2fld_out')
+        self.kwargs.pop('output_file_format')
+        self.kwargs['database'] = get_database(n_files)
+
+    def time_workplan(self, n_files):
+        planner(**self.kwargs).workplan
+
+    def peakmem_workplan(self, n_files):
+        planner(**self.kwargs).workplan
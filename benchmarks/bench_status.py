@@ -0,0 +1,23 @@
+"""
+Benchmarks of the production status entry points.
+"""
+from .bench_planner import bench_dir
+from . import synthetic
+
+
+class LoadLogs:
+    params = ([20, 200], [30])
+    param_names = ['n_products', 'n_days']
+    timeout = 600
+
+    def setup(self, n_products, n_days):
+        # production_status needs matplotlib and atmPy
+        import productomator.production_status as prodstat
+        self.load_logs = prodstat.load_logs
+        self.folder = synthetic.make_logs(bench_dir() / f'logs_{n_products}_{n_days}', n_products = n_products, n_days = n_days)
+
+    def time_load_logs(self, n_products, n_days):
+        self.load_logs(self.folder, nodays = n_days)
+
+    def peakmem_load_logs(self, n_products, n_days):
+        self.load_logs(self.folder, nodays = n_days)
@@ -0,0 +1,76 @@
+"""
+Run the benchmarks without asv and print wall time and peak memory
+(tracemalloc) for each benchmark and parameter combination.
+
+    python -m benchmarks.run [pattern] [--n-files 10000 1000000] [--quick]
+
+pattern selects benchmarks by name (e.g. Workplan.time_iter_workplan),
+--n-files replaces the n_files parameter values (10k to 5M files) and
+--quick only runs the first value of each parameter.
+"""
+import argparse
+import importlib
+import inspect
+import itertools
+import time
+import tracemalloc
+
+MODULES = ['benchmarks.bench_planner', 'benchmarks.bench_status']
+
+
+def _param_sets(cls, n_files = None, quick = False):
+    params = [list(p) for p in getattr(cls, 'params', [])]
+    names = list(getattr(cls, 'param_names', []))
+    if n_files is not None and 'n_files' in names:
+        params[names.index('n_files')] = n_files
+    if quick:
+        params = [p[:1] for p in params]
+    return list(itertools.product(*params)), names
+
+
+def run(pattern = '', n_files = None, quick = False):
+    results = []
+    for modname in MODULES:
+        mod = importlib.import_module(modname)
+        for clsname, cls in inspect.getmembers(mod, inspect.isclass):
+            if cls.__module__ != mod.__name__:
+                continue
+            methods = [m for m in dir(cls) if m.startswith('time_') and pattern in f'{clsname}.{m}']
+            if len(methods) == 0:
+                continue
+            param_sets, names = _param_sets(cls, n_files = n_files, quick = quick)
+            for params in param_sets:
+                bench = cls()
+                try:
+                    bench.setup(*params)
+                except ImportError as e:
+                    print(f'skip {clsname}{params}: {e}')
+                    break
+                except NotImplementedError as e:
+                    # asv convention: the parameter combination is skipped
+                    print(f'skip {clsname}{params}: {e}')
+                    continue
+                for method in methods:
+                    func = getattr(bench, method)
+                    start = time.perf_counter()
+                    func(*params)
+                    wall = time.perf_counter() - start
+                    # second run for the memory, tracemalloc slows things down
+                    tracemalloc.start()
+                    func(*params)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    name = f'{clsname}.{method}'
+                    label = ', '.join(f'{n}={v}' for n, v in zip(names, params))
+                    results.append((name, label, wall, peak / 1e6))
+                    print(f'{name:<45} {label:<50} {wall:10.3f} s {peak / 1e6:10.1f} MB', flush = True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pattern', nargs = '?', default = '')
+    parser.add_argument('--n-files', nargs = '+', type = int, default = None)
+    parser.add_argument('--quick', action = 'store_true')
+    args = parser.parse_args()
+    run(pattern = args.pattern, n_files = args.n_files, quick = args.quick)
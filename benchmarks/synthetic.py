@@ -0,0 +1,138 @@
+"""
+Generator of synthetic archives for the benchmarks: input/output directory
+trees (flat or yearly), SQLite databases for the database mode and Reporter
+log directories.
+"""
+import pathlib as pl
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def _touch(p2f):
+    os.close(os.open(p2f, os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+def effective_files_per_day(n_files, files_per_day = 1, max_days = 10957):
+    """files_per_day, raised if needed so that n_files span at most max_days days (the default is 30 years)."""
+    return max(files_per_day, int(np.ceil(n_files / max_days)))
+
+
+def archive_dates(n_files, files_per_day = 1, start = '2000-01-01'):
+    """Timestamps of n_files input files, files_per_day files per day (see effective_files_per_day)."""
+    files_per_day = effective_files_per_day(n_files, files_per_day)
+    return pd.date_range(start, periods = n_files, freq = pd.Timedelta(days = 1) / files_per_day)
+
+
+def make_archive(root, n_files = 10000, layout = 'yearly', files_per_day = 1, start = '2000-01-01',
+                 fraction_processed = 0.9, prefix = 'instrument_site_'):
+    """
+    Create an input tree with n_files (empty) files named 
+    f'{prefix}%Y%m%d%H%M%S.nc' and an output tree in which the first 
+    fraction_processed of the days already exist (f'product_%Y%m%d.nc'). 
+    The newest output file is a valid netcdf file with a day_complete attribute.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        Everything is created below this folder (in/ and out/).
+    n_files : int, optional
+        Number of input files, 10k to several millions. The default is 10000.
+    layout : str, optional
+        'yearly' or 'flat', used for the input and the output tree.
+    files_per_day : int, optional
+        Number of input files per day. The default is 1, large archives get more files per day 
+        (see archive_dates).
+    start : str, optional
+        Date of the first file.
+    fraction_processed : float, optional
+        Fraction of the days that have an output file.
+
+    Returns
+    -------
+    dict with the keyword arguments for a Workplanner, see archive_kwargs.
+    """
+    root = pl.Path(root)
+    p2fld_in = root / 'in'
+    p2fld_out = root / 'out'
+    dates = archive_dates(n_files, files_per_day = files_per_day, start = start)
+    for year in dates.year.unique():
+        folder_in = p2fld_in / f'{year}' if layout == 'yearly' else p2fld_in
+        folder_in.mkdir(parents = True, exist_ok = True)
+        for name in dates[dates.year == year].strftime(f'{prefix}%Y%m%d%H%M%S.nc'):
+            _touch(folder_in / name)
+
+    days = dates.normalize().unique()
+    done = days[:int(len(days) * fraction_processed)]
+    for year in done.year.unique():
+        folder_out = p2fld_out / f'{year}' if layout == 'yearly' else p2fld_out
+        folder_out.mkdir(parents = True, exist_ok = True)
+        for name in done[done.year == year].strftime('product_%Y%m%d.nc'):
+            _touch(folder_out / name)
+    p2fld_out.mkdir(parents = True, exist_ok = True)
+    if len(done) > 0:
+        # the newest output is a real netcdf file, as the file complete checks open it
+        last = done[-1]
+        folder_out = p2fld_out / f'{last.year}' if layout == 'yearly' else p2fld_out
+        xr.Dataset(attrs = {'day_complete': 'True'}).to_netcdf(folder_out / f'product_{last:%Y%m%d}.nc')
+    return archive_kwargs(root, layout)
+
+
+def archive_kwargs(root, layout):
+    """Keyword arguments for a Workplanner working on the archive created by make_archive (p2fld_in, 
+    p2fld_out, output_file_format, input_directory_structure, date_regex, date_format)."""
+    root = pl.Path(root)
+    return dict(p2fld_in = str(root / 'in'),
+                p2fld_out = str(root / 'out'),
+                output_file_format = 'product_{date}.nc',
+                input_directory_structure = layout,
+                date_regex = r'_(?P<date>\d{14})\.nc$',
+                date_format = '%Y%m%d%H%M%S',
+                )
+
+
+def make_database(path2database, n_files = 10000, files_per_day = 1, start = '2000-01-01',
+                  fraction_processed = 0.9, n_extra_columns = 20, prefix = 'instrument_site_'):
+    """
+    Create a SQLite database with one row per processed input file, as used
+    by the database mode of the Workplanner (table 'product', columns
+    'row_timestamp' and 'input_file' plus n_extra_columns data columns).
+
+    Returns
+    -------
+    tuple for the database parameter of the Workplanner.
+    """
+    dates = archive_dates(n_files, files_per_day = files_per_day, start = start)
+    dates = dates[:int(len(dates) * fraction_processed)]
+    df = pd.DataFrame({'row_timestamp': dates.astype(str),
+                       'input_file': dates.strftime(f'/data/{prefix}%Y%m%d%H%M%S.nc')})
+    rng = np.random.default_rng(0)
+    for i in range(n_extra_columns):
+        df[f'var{i}'] = rng.random(len(df))
+    path2database = pl.Path(path2database)
+    path2database.parent.mkdir(parents = True, exist_ok = True)
+    with sqlite3.connect(path2database) as conn:
+        df.to_sql('product', conn, if_exists = 'replace', index = False)
+    return (str(path2database), 'product', 'row_timestamp', 'input_file')
+
+
+def make_logs(folder, n_products = 20, n_days = 30, entries_per_day = 24):
+    """Create a Reporter log directory with n_products log files covering the last n_days."""
+    folder = pl.Path(folder)
+    folder.mkdir(parents = True, exist_ok = True)
+    end = pd.Timestamp.now()
+    index = pd.date_range(end - pd.Timedelta(days = n_days), end, periods = n_days * entries_per_day)
+    rng = np.random.default_rng(0)
+    for i in range(n_products):
+        df = pd.DataFrame({'rund_status': 0,
+                           'error': rng.integers(0, 2, len(index)),
+                           'success': rng.integers(0, 50, len(index)),
+                           'warning': rng.integers(0, 3, len(index)),
+                           'subprocess': f'product{i}',
+                           'server': 'server.example.org',
+                           'comment': ''}, index = index)
+        df.index.name = 'datetime'
+        df.to_csv(folder / f'product{i}.log')
+    return str(folder)
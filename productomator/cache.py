@@ -0,0 +1,214 @@
+import pathlib as pl
+import os
+import time
+import json
+import fnmatch
+
+
+def _write_json(path2file, content):
+    """Write content to a temporary file and rename it, so readers never see a partial file."""
+    path2file.parent.mkdir(parents = True, exist_ok = True)
+    tmp = path2file.with_name(f'.{path2file.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as raus:
+        json.dump(content, raus)
+    os.replace(tmp, path2file)
+
+
+class ScanManifest(object):
+    def __init__(self, path2manifest, settle_time = 2):
+        """
+        On-disk manifest of directory listings, keyed by directory path and
+        mtime. Directories whose mtime did not change since the last scan are
+        served from the manifest instead of being listed again, which saves a
+        lot of metadata traffic on network file systems.
+
+        Parameters
+        ----------
+        path2manifest : str or pathlib.Path
+            Path to the manifest file (json). Will be created if it does not exist.
+        settle_time : float, optional
+            Listings that were taken less than settle_time seconds after the
+            last modification of the directory are not trusted, as a file
+            written within the same mtime tick would go unnoticed.
+            The default is 2.
+        """
+        self.path2manifest = pl.Path(path2manifest)
+        self.settle_time = settle_time
+        self._dirs = None
+        self._changed = False
+
+    @property
+    def dirs(self):
+        if isinstance(self._dirs, type(None)):
+            self._load()
+        return self._dirs
+
+    def _load(self):
+        self._dirs = {}
+        if not self.path2manifest.is_file():
+            return
+        try:
+            with open(self.path2manifest, 'r') as rein:
+                manifest = json.load(rein)
+            self._dirs = manifest['dirs']
+        except (ValueError, KeyError) as e:
+            print(f'Warning: scan manifest {self.path2manifest} is corrupt and will be rebuilt ({e}).')
+
+    def _scan(self, directory):
+        """Return the manifest entry of directory, list it only if it changed."""
+        key = str(directory)
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self.dirs.pop(key, None)
+            return None
+        entry = self.dirs.get(key)
+        if entry is not None and entry['mtime_ns'] == mtime_ns and (entry['scanned_ns'] - mtime_ns) > self.settle_time * 1e9:
+            return entry
+
+        files = []
+        subdirs = []
+        with os.scandir(directory) as it:
+            for de in it:
+                if de.is_dir():
+                    subdirs.append(de.name)
+                else:
+                    files.append(de.name)
+        entry = dict(mtime_ns = mtime_ns,
+                     scanned_ns = time.time_ns(),
+                     files = sorted(files),
+                     subdirs = sorted(subdirs))
+        self.dirs[key] = entry
+        self._changed = True
+        return entry
+
+    def listdir(self, directory, pattern = '*'):
+        """Names of the files in directory that match the glob pattern."""
+        entry = self._scan(directory)
+        if entry is None:
+            return []
+        return fnmatch.filter(entry['files'], pattern)
+
+    def subdirs(self, directory):
+        """Names of the subdirectories of directory."""
+        entry = self._scan(directory)
+        if entry is None:
+            return []
+        return entry['subdirs']
+
+    def glob(self, directory, pattern, yearly = False):
+        """Replacement for directory.glob(pattern) (flat) or directory.glob(f'*/{pattern}') (yearly).
+        Only directories that changed since the last scan are listed."""
+        directory = pl.Path(directory)
+        if yearly:
+            folders = [directory / sub for sub in self.subdirs(directory)]
+        else:
+            folders = [directory]
+        for folder in folders:
+            for name in self.listdir(folder, pattern):
+                yield folder / name
+        self.save()
+
+    def save(self):
+        if not self._changed:
+            return
+        _write_json(self.path2manifest, dict(version = 1, dirs = self.dirs))
+        self._changed = False
+
+    def invalidate(self):
+        """Forget all listings, the next scan will list every directory again."""
+        self._dirs = {}
+        self._changed = False
+        if self.path2manifest.is_file():
+            self.path2manifest.unlink()
+
+
+def read_global_attributes(path):
+    """
+    Read the global attributes of a NetCDF (or HDF5) file without building an
+    xarray Dataset. Only the header is read. Uses netCDF4 if available, h5py
+    otherwise (NetCDF4/HDF5 files only) and falls back to xarray.
+
+    Returns
+    -------
+    dict
+    """
+    try:
+        import netCDF4
+    except ImportError:
+        netCDF4 = None
+    if netCDF4 is not None:
+        with netCDF4.Dataset(path, 'r') as nc:
+            return {key: nc.getncattr(key) for key in nc.ncattrs()}
+
+    try:
+        import h5py
+    except ImportError:
+        h5py = None
+    if h5py is not None and h5py.is_hdf5(path):
+        with h5py.File(path, 'r') as f:
+            return {key: (value.decode() if isinstance(value, bytes) else value) for key, value in f.attrs.items()}
+
+    import xarray as xr
+    with xr.open_dataset(path) as ds:
+        return dict(ds.attrs)
+
+
+def _jsonable(value):
+    if hasattr(value, 'tolist'): # numpy scalars and arrays
+        value = value.tolist()
+    if isinstance(value, (str, int, float, bool, list)) or value is None:
+        return value
+    return str(value)
+
+
+class AttributeCache(object):
+    def __init__(self, path2cache = None):
+        """
+        Cache of the global attributes of files, keyed by (path, mtime, size).
+        Files that did not change are not opened again.
+
+        Parameters
+        ----------
+        path2cache : str or pathlib.Path, optional
+            Path to the cache file (json). If None, the cache only lives in memory.
+        """
+        self.path2cache = None if path2cache is None else pl.Path(path2cache)
+        self._files = None
+        self._changed = False
+
+    @property
+    def files(self):
+        if isinstance(self._files, type(None)):
+            self._files = {}
+            if self.path2cache is not None and self.path2cache.is_file():
+                try:
+                    with open(self.path2cache, 'r') as rein:
+                        self._files = json.load(rein)['files']
+                except (ValueError, KeyError) as e:
+                    print(f'Warning: attribute cache {self.path2cache} is corrupt and will be rebuilt ({e}).')
+        return self._files
+
+    def get(self, path):
+        """Global attributes of the file at path (see read_global_attributes)."""
+        st = os.stat(path)
+        key = str(path)
+        entry = self.files.get(key)
+        if entry is not None and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry['attrs']
+        attrs = {k: _jsonable(v) for k, v in read_global_attributes(path).items()}
+        self.files[key] = dict(mtime_ns = st.st_mtime_ns, size = st.st_size, attrs = attrs)
+        self._changed = True
+        return attrs
+
+    def save(self):
+        if not self._changed or self.path2cache is None:
+            return
+        _write_json(self.path2cache, dict(version = 1, files = self.files))
+        self._changed = False
+
+    def invalidate(self):
+        self._files = {}
+        self._changed = False
+        if self.path2cache is not None and self.path2cache.is_file():
+            self.path2cache.unlink()
@@ -13,8 +13,144 @@ from email.mime.text import MIMEText as _MIMEText
 import smtplib as _smtplib
 import pandas as _pd
 import socket
+import time as _time
+import random as _random
+import contextlib as _contextlib
+import math as _math
+import os as _os
+import threading as _threading
+import weakref as _weakref
+import multiprocessing as _mp
 
 
+class Summary(object):
+    def __init__(self, sample_size = 1024):
+        """
+        Streaming summary of a series of values (e.g. durations): count, 
+        total and max are exact, quantiles are estimated from a fixed size 
+        reservoir sample, so adding a value is O(1) and memory is bounded.
+
+        Parameters
+        ----------
+        sample_size : int, optional
+            Size of the reservoir sample. The default is 1024.
+        """
+        self.sample_size = sample_size
+        self.count = 0
+        self.total = 0.
+        self.max = float('nan')
+        self._sample = []
+        self._rng = _random.Random(0)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if not value <= self.max: # also true for the initial nan
+            self.max = value
+        if len(self._sample) < self.sample_size:
+            self._sample.append(value)
+        else:
+            i = self._rng.randrange(self.count)
+            if i < self.sample_size:
+                self._sample[i] = value
+
+    def quantile(self, q):
+        if len(self._sample) == 0:
+            return float('nan')
+        sample = sorted(self._sample)
+        return sample[min(int(q * len(sample)), len(sample) - 1)]
+
+    def merge(self, other):
+        """Add the values summarized by other (e.g. from another process)."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.max = other.max
+        else:
+            self.max = max(self.max, other.max)
+        # each sample value represents count/len(sample) values, draw the merged sample accordingly
+        pool = [(v, self.count / len(self._sample)) for v in self._sample] + [(v, other.count / len(other._sample)) for v in other._sample]
+        self.count += other.count
+        self.total += other.total
+        if len(pool) <= self.sample_size:
+            self._sample = [v for v, w in pool]
+        else:
+            self._sample = self._rng.choices([v for v, w in pool], weights = [w for v, w in pool], k = self.sample_size)
+
+    def to_dict(self):
+        return dict(count = self.count, 
+                    total = self.total, 
+                    p50 = self.quantile(0.5), 
+                    p95 = self.quantile(0.95), 
+                    max = self.max)
+
+
+class Throughput(object):
+    def __init__(self, total = None, timescale = 300):
+        """
+        Live throughput of a run in rows per second, exponentially smoothed 
+        over time, and the resulting ETA.
+
+        Parameters
+        ----------
+        total : int, optional
+            Number of rows of the run, needed for the ETA.
+        timescale : float, optional
+            Smoothing time scale in seconds: the rate reflects mostly the 
+            last timescale seconds. The default is 300.
+        """
+        self.total = total
+        self.timescale = timescale
+        self.done = 0
+        self.rate = float('nan')
+        self.starttime = _time.time()
+        self._last = self.starttime
+
+    def update(self, n = 1):
+        """Count n finished rows."""
+        now = _time.time()
+        dt = max(now - self._last, 1e-9)
+        self.done += n
+        if self.rate != self.rate: # nan, first update
+            self.rate = n / max(now - self.starttime, 1e-9)
+        else:
+            alpha = 1 - _math.exp(-dt / self.timescale)
+            self.rate += alpha * (n / dt - self.rate)
+        self._last = now
+
+    @property
+    def remaining(self):
+        if self.total is None:
+            return None
+        return max(self.total - self.done, 0)
+
+    @property
+    def eta(self):
+        """Expected remaining time (pandas.Timedelta), None if unknown."""
+        if self.remaining is None or not self.rate > 0:
+            return None
+        return _pd.to_timedelta(self.remaining / self.rate, unit = 's')
+
+    def __str__(self):
+        total = '' if self.total is None else f'/{self.total}'
+        eta = '' if self.eta is None else f', ETA {self.eta.round("s")} ({(_pd.Timestamp.now() + self.eta).round("s")})'
+        return f'{self.done}{total} rows, {self.rate:.3g} rows/s{eta}'
+
+
+# counter fields of a shard
+_CLEAN, _WARNING, _ERROR = 0, 1, 2
+
+# a forked child claims its own shards, the thread local data (the shard of
+# the forking thread) is copied by fork
+_reporters = _weakref.WeakSet()
+
+def _forget_shards():
+    for reporter in list(_reporters):
+        reporter._local = _threading.local()
+
+if hasattr(_os, 'register_at_fork'):
+    _os.register_at_fork(after_in_child = _forget_shards)
+
 class Reporter(object):
     def __init__(self, 
                  name = None, 
@@ -22,7 +158,29 @@ class Reporter(object):
                  log_folder = '/home/grad/htelg/.processlogs/',
                  verbose = True, 
                  reporting_frequency = (1,'h'),
+                 max_shards = 256,
                  ):
+        """
+        Counts clean rows, warnings and errors of a process and writes them to a log file.
+
+        The counters work across threads and forked processes (e.g. 
+        multiprocessing or concurrent.futures with the fork start method): 
+        they live in shared memory, split into one shard per thread and process, 
+        so increments are plain writes to the own shard without any locking. The 
+        shards are summed up when the counters are read (clean, warnings, 
+        errors, log, wrapup). Processes that are not forked (spawn) get a 
+        pickled copy with the counts at that time, their increments are not 
+        seen by the parent.
+
+        Parameters
+        ----------
+        max_shards : int, optional
+            Number of counter shards, i.e. threads and processes that can count 
+            without a lock. Further ones share an extra shard that is protected 
+            by a lock. The default is 256.
+        """
+        self.max_shards = max_shards
+        self._init_counters()
         if isinstance(log_folder, type(None)):
             self.path2log = None
         else:
@@ -35,32 +193,122 @@ class Reporter(object):
         if verbose:
             print(f'start time: {self.starttime}')
     
+    def _init_counters(self, counts = (0, 0, 0)):
+        """Create the shared counter shards, counts (clean, warnings, errors) go into the shared shard."""
+        self._counts = _mp.RawArray('q', (self.max_shards + 1) * 3) # the last shard is the shared one
+        for field in (_CLEAN, _WARNING, _ERROR):
+            self._counts[self.max_shards * 3 + field] = counts[field]
+        self._next_shard = _mp.RawValue('i', 0)
+        self._shard_lock = _mp.Lock()
+        self._local = _threading.local()
+        _reporters.add(self)
+    
+    def __getstate__(self):
+        # shared memory, lock and thread local data can not be pickled, the counts are passed on
+        state = self.__dict__.copy()
+        for key in ['_counts', '_next_shard', '_shard_lock', '_local']:
+            state.pop(key)
+        state['_base'] = [0, 0, 0]
+        state['_snapshot'] = (self.clean, self.warnings, self.errors)
+        return state
+    
+    def __setstate__(self, state):
+        counts = state.pop('_snapshot')
+        self.__dict__.update(state)
+        self._init_counters(counts)
+    
     def reset(self):
-        self._clean = 0
-        self._warning = 0
-        self._error = 0
+        # the shards keep counting, the counters are relative to the totals at the reset
+        self._base = [self._total(field) for field in (_CLEAN, _WARNING, _ERROR)]
+        self.timings = {}
+        self.comments = []
         self._starttime = _pd.Timestamp.now()
     
+    def _shard(self):
+        """Offset of the counter shard of the current thread (in this process)."""
+        try:
+            return self._local.offset
+        except AttributeError:
+            pass
+        with self._shard_lock:
+            shard = self._next_shard.value
+            if shard < self.max_shards:
+                self._next_shard.value += 1
+        # None means the shared shard, which needs the lock
+        self._local.offset = shard * 3 if shard < self.max_shards else None
+        return self._local.offset
+    
+    def _increment(self, field, value):
+        offset = self._shard()
+        if offset is not None:
+            self._counts[offset + field] += value
+        else:
+            with self._shard_lock:
+                self._counts[self.max_shards * 3 + field] += value
+    
+    def _total(self, field):
+        return sum(self._counts[field::3])
+    
     @property
     def clean(self):
-        return self._clean
+        return self._total(_CLEAN) - self._base[_CLEAN]
     
     def clean_increment(self, value = 1):
-        self._clean += value
+        self._increment(_CLEAN, value)
     
     @property
     def warnings(self):
-        return self._warning
+        return self._total(_WARNING) - self._base[_WARNING]
     
     def warnings_increment(self, value = 1):
-        self._warning += value
+        self._increment(_WARNING, value)
     
     @property
     def errors(self):
-        return self._error
+        return self._total(_ERROR) - self._base[_ERROR]
     
     def errors_increment(self, value = 1):
-        self._error += value
+        self._increment(_ERROR, value)
+    
+    def add_comment(self, comment):
+        """Add a comment to the next log entry (commas are replaced, they would break the csv)."""
+        self.comments.append(str(comment).replace(',', ';').replace('\n', ' '))
+    
+    def record(self, name, value):
+        """Add a value (e.g. a duration in seconds) to the streaming summary name."""
+        summary = self.timings.get(name)
+        if summary is None:
+            summary = self.timings[name] = Summary()
+        summary.add(value)
+    
+    @_contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager that records the wall time of the enclosed block under 
+        name. Workplanner.process records each row as 'row', use it in 
+        process_row to see where the time goes:
+            
+            with self.reporter.phase('read'):
+                ds = self.get_inputs(row)
+            with self.reporter.phase('write'):
+                ds.to_netcdf(row.p2f_out)
+        """
+        start = _time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, _time.perf_counter() - start)
+    
+    def merge_timings(self, timings):
+        """Merge summaries (dict name: Summary, e.g. from a worker process) into this reporter."""
+        for name, summary in timings.items():
+            if name not in self.timings:
+                self.timings[name] = Summary()
+            self.timings[name].merge(summary)
+    
+    def timing_summary(self):
+        """DataFrame with count, total, p50, p95 and max (seconds) for each recorded phase."""
+        return _pd.DataFrame({name: summary.to_dict() for name, summary in self.timings.items()}).transpose()
     
     @property
     def settings(self):
@@ -122,7 +370,8 @@ class Reporter(object):
         # warning = self.the_automated_process.no_processed_warning
         subprocess = self.name#### TODO: not sure what this was ment for in the early days
         server = socket.gethostname()
-        comment = ''
+        # comments and timing summaries go into the comment, separated by ; to keep the csv intact
+        comment = ';'.join(self.comments + [f'{name}_p50={s.quantile(0.5):.3g};{name}_p95={s.quantile(0.95):.3g};{name}_max={s.max:.3g}' for name, s in self.timings.items()])
         log_string = f'{datetime},{run_status},{self.errors},{self.clean},{self.warnings},{subprocess},{server},{comment}\n'
         return log_string
     
@@ -234,6 +483,9 @@ class Reporter(object):
             print(f'number of cleanes: {self.clean}')
             print(f'number of errors: {self.errors}')
             print(f'number of warnings: {self.warnings}')
+            if len(self.timings) > 0:
+                print('recorded values (timings in s):')
+                print(self.timing_summary().to_string(float_format = lambda x: f'{x:.3g}'))
             endtime = _pd.Timestamp.now()
             print(f'time finished: {endtime}')
             duration = (endtime - self.starttime) / _pd.to_timedelta(1, 'h')
@@ -243,7 +495,8 @@ class Reporter(object):
 
 class Automation(object):
     def __init__(self, the_automated_process, product_name = None):
-        """ This strategy of reporting has turned out to be disadvantage over the Reporter class, in particular for parallelized processes
+        """ This strategy of reporting has turned out to be disadvantage over the Reporter class, in particular for parallelized processes:
+        the counters of the Reporter are shared between threads and forked worker processes, the ones here are not.
         The automation instance helps you with notification and logging of the automated process.
         Typically the process would be run in a crone job.
         
@@ -0,0 +1,281 @@
+import pathlib as pl
+import os
+import json
+import sqlite3
+import pandas as pd
+
+
+def fingerprint(p2fs):
+    """(path, size, mtime_ns) of each file, sorted by path. Missing files get None for size and mtime."""
+    if not isinstance(p2fs, (list, tuple)):
+        p2fs = [p2fs]
+    fps = []
+    for p2f in sorted(str(p) for p in p2fs):
+        try:
+            st = os.stat(p2f)
+            fps.append([p2f, st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            fps.append([p2f, None, None])
+    return fps
+
+
+class InputLedger(object):
+    def __init__(self, path2ledger):
+        """
+        Persistent record (SQLite) of the inputs that went into each output
+        file. For every produced row the (path, size, mtime) fingerprints of
+        its input files and the product version are stored. This allows a
+        make-style incremental reprocessing: only rows whose inputs were
+        reissued, or that were made with a different product version, are
+        processed again.
+
+        Parameters
+        ----------
+        path2ledger : str or pathlib.Path
+            Path to the SQLite file, e.g. next to the output files.
+        """
+        self.path2ledger = pl.Path(path2ledger)
+        self.path2ledger.parent.mkdir(parents = True, exist_ok = True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                         'p2f_out TEXT PRIMARY KEY, '
+                         'inputs TEXT, '
+                         'product_version TEXT, '
+                         'processed TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path2ledger, timeout = 60)
+
+    def record(self, p2f_out, p2f_in, product_version = None):
+        """Store the current fingerprints of the input file(s) p2f_in for the output file p2f_out."""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                         (str(p2f_out),
+                          json.dumps(fingerprint(p2f_in)),
+                          None if product_version is None else str(product_version),
+                          pd.Timestamp.now().isoformat()))
+
+    def forget(self, p2f_out):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM outputs WHERE p2f_out = ?', (str(p2f_out),))
+
+    def entries(self):
+        """All records as a DataFrame indexed by p2f_out."""
+        with self._connect() as conn:
+            df = pd.read_sql_query('SELECT * FROM outputs', conn, index_col = 'p2f_out')
+        return df
+
+    def lookup(self, p2f_out):
+        """(fingerprints of the inputs, product version) recorded for p2f_out, None if there is no record."""
+        with self._connect() as conn:
+            res = conn.execute('SELECT inputs, product_version FROM outputs WHERE p2f_out = ?', (str(p2f_out),)).fetchone()
+        if res is None:
+            return None
+        return json.loads(res[0]), res[1]
+
+    def inputs(self, p2f_out):
+        """The input files that were recorded for p2f_out (empty list if there is no record)."""
+        with self._connect() as conn:
+            res = conn.execute('SELECT inputs FROM outputs WHERE p2f_out = ?', (str(p2f_out),)).fetchone()
+        if res is None:
+            return []
+        return [fp[0] for fp in json.loads(res[0])]
+
+    def changed(self, wp, product_version = None):
+        """
+        Which rows of wp have inputs that changed since they were recorded (or
+        were made with a different product version). Rows without a record
+        (e.g. produced before the ledger was used) count as unchanged.
+
+        Parameters
+        ----------
+        wp : pandas.DataFrame
+            Needs the columns p2f_in and p2f_out.
+        product_version : str, optional
+            Current product version. If None, versions are not compared.
+
+        Returns
+        -------
+        pandas.Series of bool, aligned with wp.
+        """
+        out = pd.Series(False, index = wp.index, dtype = bool)
+        if len(wp) == 0:
+            return out
+        with self._connect() as conn:
+            records = {p2f_out: (inputs, version) for p2f_out, inputs, version in conn.execute('SELECT p2f_out, inputs, product_version FROM outputs')}
+        for i, (p2f_in, p2f_out) in enumerate(zip(wp.p2f_in, wp.p2f_out)):
+            rec = records.get(str(p2f_out))
+            if rec is None:
+                continue
+            inputs, version = rec
+            if product_version is not None and version != str(product_version):
+                out.iloc[i] = True
+            elif json.loads(inputs) != fingerprint(p2f_in):
+                out.iloc[i] = True
+        return out
+
+
+class FailureRegistry(object):
+    def __init__(self, path2registry, max_attempts = 5, backoff = 3600):
+        """
+        Persistent record (SQLite) of rows that failed. Failing rows are
+        retried with exponential backoff (backoff, 2 * backoff, 4 * backoff,
+        ... seconds after the last failure) and quarantined after max_attempts
+        failures, so corrupt inputs do not burn compute on every run. Quarantined
+        rows are only retried after they are released (release_quarantine).
+
+        Parameters
+        ----------
+        path2registry : str or pathlib.Path
+            Path to the SQLite file.
+        max_attempts : int, optional
+            Number of failures after which a row is quarantined. The default is 5.
+        backoff : float, optional
+            Waiting time in seconds after the first failure. The default is 3600.
+        """
+        self.path2registry = pl.Path(path2registry)
+        self.path2registry.parent.mkdir(parents = True, exist_ok = True)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS failures ('
+                         'key TEXT PRIMARY KEY, '
+                         'attempts INTEGER, '
+                         'exception TEXT, '
+                         'message TEXT, '
+                         'first_failed TEXT, '
+                         'last_failed TEXT, '
+                         'next_attempt REAL, '   # epoch seconds, NULL if quarantined
+                         'quarantined INTEGER)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path2registry, timeout = 60)
+
+    def record(self, key, exception):
+        """Count a failure of key. Returns True if the row is quarantined now."""
+        now = pd.Timestamp.now()
+        with self._connect() as conn:
+            res = conn.execute('SELECT attempts, first_failed FROM failures WHERE key = ?', (str(key),)).fetchone()
+            attempts, first_failed = (0, now.isoformat()) if res is None else res
+            attempts += 1
+            quarantined = attempts >= self.max_attempts
+            next_attempt = None if quarantined else now.timestamp() + self.backoff * 2**(attempts - 1)
+            conn.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (str(key), attempts, type(exception).__name__, str(exception)[:1000],
+                          first_failed, now.isoformat(), next_attempt, int(quarantined)))
+        return quarantined
+
+    def clear(self, key):
+        """Forget the failures of key, e.g. after it was processed successfully."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM failures WHERE key = ?', (str(key),))
+
+    def keys(self):
+        """Keys of all rows with recorded failures."""
+        with self._connect() as conn:
+            return {k for (k,) in conn.execute('SELECT key FROM failures')}
+
+    def blocked(self):
+        """Keys of the rows that should not be processed now: quarantined or still backing off."""
+        with self._connect() as conn:
+            res = conn.execute('SELECT key FROM failures WHERE quarantined = 1 OR next_attempt > ?', (pd.Timestamp.now().timestamp(),))
+            return {k for (k,) in res}
+
+    def entries(self):
+        """All records as a DataFrame indexed by key."""
+        with self._connect() as conn:
+            df = pd.read_sql_query('SELECT * FROM failures', conn, index_col = 'key')
+        df['next_attempt'] = pd.to_datetime(df.next_attempt, unit = 's')
+        df['quarantined'] = df.quarantined.astype(bool)
+        return df
+
+    @property
+    def quarantine(self):
+        """The quarantined rows as a DataFrame indexed by key."""
+        df = self.entries()
+        return df[df.quarantined]
+
+    def release_quarantine(self, keys = None):
+        """
+        Release rows from the quarantine (their failure history is removed), 
+        so they are processed again on the next run.
+
+        Parameters
+        ----------
+        keys : str or list of str, optional
+            Keys to release. If None, all quarantined rows are released.
+
+        Returns
+        -------
+        int : number of released rows
+        """
+        with self._connect() as conn:
+            if keys is None:
+                cur = conn.execute('DELETE FROM failures WHERE quarantined = 1')
+            else:
+                if isinstance(keys, (str, pl.Path)):
+                    keys = [keys]
+                cur = conn.executemany('DELETE FROM failures WHERE key = ? AND quarantined = 1', [(str(k),) for k in keys])
+        return cur.rowcount
+
+
+class RowHistory(object):
+    def __init__(self, path2history):
+        """
+        Persistent record (SQLite) of what processing a row took on earlier
+        runs: the size of its input files, its peak memory (RSS) and its
+        duration. Used to estimate the memory footprint of rows before they are
+        admitted (see Workplanner.process, memory_budget).
+
+        Parameters
+        ----------
+        path2history : str or pathlib.Path
+            Path to the SQLite file.
+        """
+        self.path2history = pl.Path(path2history)
+        self.path2history.parent.mkdir(parents = True, exist_ok = True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rows ('
+                         'key TEXT PRIMARY KEY, '
+                         'input_bytes INTEGER, '
+                         'peak_rss INTEGER, '
+                         'duration REAL, '
+                         'updated TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path2history, timeout = 60)
+
+    def record(self, key, input_bytes = None, peak_rss = None, duration = None):
+        """Record a run of the row key. Values that are None (e.g. the peak RSS could not be measured) 
+        keep the value of an earlier run."""
+        with self._connect() as conn:
+            conn.execute('INSERT INTO rows VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                         'input_bytes = COALESCE(excluded.input_bytes, rows.input_bytes), '
+                         'peak_rss = COALESCE(excluded.peak_rss, rows.peak_rss), '
+                         'duration = COALESCE(excluded.duration, rows.duration), '
+                         'updated = excluded.updated',
+                         (str(key), input_bytes, peak_rss, duration, pd.Timestamp.now().isoformat()))
+
+    def entries(self):
+        """All records as a DataFrame indexed by key."""
+        with self._connect() as conn:
+            df = pd.read_sql_query('SELECT * FROM rows', conn, index_col = 'key')
+        return df
+
+    def peaks(self):
+        """dict key: peak RSS (bytes) of the rows for which it was measured."""
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT key, peak_rss FROM rows WHERE peak_rss IS NOT NULL'))
+
+    def durations(self):
+        """dict key: duration (seconds) of the last successful run of each row."""
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT key, duration FROM rows WHERE duration IS NOT NULL'))
+
+    def memory_ratio(self):
+        """Median ratio of peak RSS to input size over all recorded rows, None if there are none."""
+        with self._connect() as conn:
+            ratios = [r for (r,) in conn.execute('SELECT CAST(peak_rss AS REAL) / input_bytes FROM rows WHERE peak_rss IS NOT NULL AND input_bytes > 0')]
+        if len(ratios) == 0:
+            return None
+        return float(pd.Series(ratios).median())
@@ -1,12 +1,27 @@
 import pathlib as pl
+import os
+import re
+import fnmatch
+import itertools
+import collections
 import socket
 import sqlite3
+import time
+import contextlib
+import asyncio
+import inspect
+import concurrent.futures as cf
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
 import xarray as xr
 import productomator.lab as prodlab
+import productomator.cache as prodcache
+import productomator.ledger as prodledger
+import productomator.workqueue as prodqueue
 
 
-def files_between(root: pl.Path, start: pd.Timestamp, end: pd.Timestamp, globpattern: str = "", input_directory_structure: str = "yearly"):
+def files_between(root: pl.Path, start: pd.Timestamp, end: pd.Timestamp, globpattern: str = "", input_directory_structure: str = "yearly", method: str = "glob", listdir = None):
     """ Generator that yields all files between start and end dates (inclusive) in the given root directory.
     Parameters
     ----------
@@ -18,12 +33,27 @@ def files_between(root: pl.Path, start: pd.Timestamp, end: pd.Timestamp, globpat
         End date.
     globpattern : str, optional
         Glob pattern to match files. The default is mainly covering the extension, set to '*.nc' for netcdf files."".
+    input_directory_structure : str, optional
+        'yearly' or 'flat'.
+    method : str, optional
+        glob (default): one glob per day, f"*{date:%Y%m%d}{globpattern}".
+        scan: each year directory (or the flat root) is listed only once and the date is taken from 
+            the names with one compiled pattern. Yields the same files as glob, much faster for long 
+            ranges. Within a day, files are yielded in alphabetical order.
+    listdir : callable, optional
+        Only used with method scan. Function that returns the names in a directory, e.g. 
+        ScanManifest.listdir. Defaults to os.listdir.
     Yields
     -------
     pl.Path
         Paths to files between start and end dates.
     """ 
     assert(end > start), f'End must come after start! (end: {end}, start{start})'
+    if method == 'scan':
+        yield from _files_between_scan(root, start, end, globpattern, input_directory_structure, listdir)
+        return
+    elif method != 'glob':
+        raise ValueError(f'method must be either "glob" or "scan", got {method}')
     root = root
     d = start
     while d <= end:
@@ -34,13 +64,146 @@ def files_between(root: pl.Path, start: pd.Timestamp, end: pd.Timestamp, globpat
         yield from year_dir.glob(f"*{d:%Y%m%d}{globpattern}")
         d += pd.to_timedelta(1, 'D')
 
+
+# every position in a name where 8 digits (a %Y%m%d date) start, including overlapping ones
+_date_candidates = re.compile(r'(?=(\d{8}))')
+
+def _files_between_scan(root, start, end, globpattern, input_directory_structure, listdir):
+    """Single-pass implementation of files_between, see there."""
+    root = pl.Path(root)
+    if listdir is None:
+        listdir = os.listdir
+    suffix = re.compile(fnmatch.translate(globpattern))
+    # same days as the daily loop in files_between
+    days = {}
+    for d in pd.date_range(start, end, freq = 'D'):
+        days.setdefault(d.year, set()).add(f'{d:%Y%m%d}')
+    if input_directory_structure == 'yearly':
+        folders = [(root / f'{year}', days[year]) for year in sorted(days)]
+    else:
+        folders = [(root, set().union(*days.values()))]
+
+    for folder, folder_days in folders:
+        try:
+            names = listdir(folder)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        matches = set()
+        for name in names:
+            for m in _date_candidates.finditer(name):
+                if m.group(1) in folder_days and suffix.match(name, m.start() + 8):
+                    matches.add((m.group(1), name))
+        for day, name in sorted(matches):
+            yield folder / name
+
+
+def files_exist(paths):
+    """Vectorized alternative to [p.is_file() for p in paths].
+    Instead of one stat call per path, each distinct parent directory is listed
+    once with os.scandir and all paths are resolved with one membership test.
+    This works for flat as well as {year}-templated layouts, as paths are grouped
+    by their actual parent directory.
+
+    Parameters
+    ----------
+    paths : iterable of str or pathlib.Path
+
+    Returns
+    -------
+    numpy.ndarray of bool
+    """
+    paths = pd.Series([str(p) for p in paths], dtype = object)
+    existing = set()
+    for folder in paths.map(os.path.dirname).unique():
+        try:
+            with os.scandir(folder if folder else '.') as it:
+                existing.update(os.path.join(folder, de.name) for de in it if de.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return paths.isin(existing).to_numpy()
+
+
+def write_netcdf_atomic(ds, p2f, **kwargs):
+    """Write ds to a temporary file next to p2f and rename it to p2f when done. A crash during 
+    the write leaves a hidden temporary file, never a truncated p2f that would count as processed.
+    kwargs are passed to ds.to_netcdf."""
+    p2f = pl.Path(p2f)
+    p2f.parent.mkdir(parents = True, exist_ok = True)
+    tmp = p2f.with_name(f'.{p2f.name}.tmp-{os.getpid()}')
+    try:
+        ds.to_netcdf(tmp, **kwargs)
+        os.replace(tmp, p2f)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+
+def _memory_status():
+    """(current RSS, peak RSS) of this process in bytes, read from /proc/self/status. 
+    None if not available (not Linux)."""
+    values = {}
+    try:
+        with open('/proc/self/status') as rein:
+            for line in rein:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':')
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        return None
+    if len(values) != 2:
+        return None
+    return values['VmRSS'], values['VmHWM']
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process to the current RSS and return the current RSS. 
+    None if the peak can not be reset (it would be the peak of the whole process lifetime)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as raus:
+            raus.write('5')
+    except OSError:
+        return None
+    status = _memory_status()
+    return None if status is None else status[0]
+
+
+# The workplanner a process pool works on. It is handed over via the pool
+# initializer so it is inherited by the forked workers instead of being pickled
+# (date_from_name is typically a lambda, which can not be pickled).
+_pool_planner = None
+
+def _pool_initializer(planner):
+    global _pool_planner
+    _pool_planner = planner
+
+def _pool_process_chunk(chunk, raise_errors):
+    # the counters of the reporter are shared with the parent, the timings are sent back
+    reporter = _pool_planner.reporter
+    reporter.timings = {}
+    clean, errors = _pool_planner._process_chunk(chunk, raise_errors)
+    return clean, errors, reporter.timings
+
+def _chunked(iterable, chunksize):
+    """Yield lists of up to chunksize items from iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
 class Workplanner():
     def __init__(self,
                  # data in and output folders
                  p2fld_in = None,
                  p2fld_out = None,
                  database = None,
+                 database_create_index = False,
                  date_from_name = None,
+                 date_regex = None,
+                 date_format = None,
                  output_file_format = None, #lalalal_{date}.nc'
                  glob_pattern_in = '*.nc',
                  start = None,
@@ -49,6 +212,17 @@ class Workplanner():
                  output_directory_structure = None,
                  file_complete_check = False, # only allows processing of files that are complete
                  reporter = None,
+                 scan_manifest = None,
+                 attribute_cache = None,
+                 ledger = None,
+                 compact_masterplan = False,
+                 existence_engine = 'scandir',
+                 queue = None,
+                 lease_time = 600,
+                 failures = None,
+                 max_attempts = 5,
+                 backoff = 3600,
+                 history = None,
                  verbose = False,
                  **kwargs,
                 ):
@@ -70,8 +244,23 @@ class Workplanner():
             Example: 
                 ('/path/to/database.sqlite', 'table_name', 'row_timestamp', 'input_file'), his will match the file names in the p2fld_in with the input_file in the database table.
                 ('/path/to/database.sqlite', 'table_name', 'row_timestamp', 'None'), this will match the dates in the masterplan (derived from the p2fld_in) with the dates in the database table (in the row_timestamp column).
+            Only the date and file path columns are read. Only the rows within the date range of the masterplan are
+            used. If the date column holds ISO text ("YYYY-mm-dd..."), the selection is done in the database, other text
+            formats are filtered after parsing.
+        database_create_index : bool, optional
+            If True, an index on the date column is created in the database (if it does not exist yet), 
+            which makes the date range selection fast. Requires write access to the database.
         date_from_name : function
             A function that extracts a date from a filename. Not from the entire path, just the name (str)!! Example: lambda name: name.split('.')[-2].split('_')[-1]
+            Calls the function once per file, consider date_regex for large archives.
+        date_regex : str, optional
+            Declarative alternative to date_from_name. A regular expression with a named group "date" (or a 
+            single group) that extracts the date string from the file name. All names are parsed in one 
+            vectorized pass, which is much faster than date_from_name for large archives. If set, 
+            date_from_name is ignored.
+            Example: r'_(?P<date>\d{8})\.nc$'
+        date_format : str, optional
+            strptime format of the string extracted by date_regex, e.g. '%Y%m%d'. If None, pandas will infer the format.
         output_file_format : str
             A format string for naming output files, with a placeholder for the date, year, month, or day. You can define more placholders as long as you provide the variables in the kwargs or declare them in the subclass. 
             Example: '{site}_specflux_{date}.nc'
@@ -93,6 +282,56 @@ class Workplanner():
             If the attribute is False, the file will be re-processed. If the first complete file is found, the attribute will no longer be checked for older files, as they are assumed to be complete as well. 
         glob_pattern : str, optional
             A glob pattern to match input files. Default is '*.nc'.
+        scan_manifest : str or pathlib.Path, optional
+            Path to a scan manifest file (json). If set, the directory listings of the input folder are
+            cached on disk, keyed by directory and mtime. On the next run only directories that changed 
+            (e.g. the current year) are listed again. Use invalidate_scan_manifest to force a full rescan.
+        attribute_cache : str or pathlib.Path, optional
+            Path to a cache file (json) for the global attributes (day_complete) read by the file complete
+            checks. Files are only opened again if their mtime or size changed. If None, attributes are
+            only cached in memory.
+        ledger : str or pathlib.Path, optional
+            Path to an input ledger (SQLite, see productomator.ledger.InputLedger), e.g. next to the outputs.
+            For each processed row the fingerprints (path, size, mtime) of its input files and the product 
+            version (self.version, if defined) are recorded. Existing outputs whose inputs changed since 
+            (reissued or late data) or that were made with another product version are processed again.
+        compact_masterplan : bool, optional
+            If True, the masterplan does not hold a pathlib.Path object per cell. Input paths are stored 
+            as a directory categorical (in_dir) plus the file names (in_name), output paths are not stored 
+            at all but generated from output_file_format when needed. Path objects are only created for 
+            the rows of the workplan. For archives with millions of files this reduces the memory of the 
+            masterplan several fold. Measured with tracemalloc for 1M input files in 11 year directories 
+            (memory retained by the masterplan): Workplanner 537 MB -> 130 MB, WorkplannerDaily 316 MB -> 
+            122 MB. The file names are pandas strings, they take even less if pyarrow is installed.
+            The default is False.
+        existence_engine : str, optional
+            How the workplan determines which output files already exist.
+                scandir (default): list each distinct output directory once (see files_exist). 
+                stat: one is_file call per output file. 
+        queue : str or pathlib.Path, optional
+            Path to a work queue (SQLite, see productomator.workqueue.LeaseQueue). Set this if several runs 
+            of the same product may overlap (e.g. cron jobs that take longer than the interval, or runs on 
+            several servers with a shared file system). Each row is claimed with a lease before it is 
+            processed and marked done afterwards, so the runs split the workplan instead of doing rows twice.
+        lease_time : float, optional
+            Seconds after which the lease of a row expires if it is not renewed. Leases are renewed by a 
+            background thread during process, so rows are only taken over from runs that died. 
+            The default is 600.
+        failures : str or pathlib.Path, optional
+            Path to a failure registry (SQLite, see productomator.ledger.FailureRegistry). Rows that fail 
+            are recorded with the exception and the number of attempts, retried with exponential backoff 
+            and quarantined after max_attempts failures. process skips rows that are backing off or 
+            quarantined. See the quarantine property and release_quarantine.
+        max_attempts : int, optional
+            Number of failures after which a row is quarantined. The default is 5.
+        backoff : float, optional
+            Seconds to wait before retrying a row that failed once, doubled with every further failure. 
+            The default is 3600.
+        history : str or pathlib.Path, optional
+            Path to a row history (SQLite, see productomator.ledger.RowHistory). For each processed row the 
+            size of its inputs, its peak memory (RSS) and its duration are recorded. The memory_budget of 
+            process estimates the footprint of rows from what they (or, relative to their input size, 
+            other rows) used on earlier runs.
 
         Examples
         --------
@@ -148,6 +387,7 @@ class Workplanner():
 
         if database is not None:
             self.database = database
+            self.database_create_index = database_create_index
         else:
             p2fld_out = p2fld_out.format(**kwargs)
             self.p2fld_out = pl.Path(p2fld_out)
@@ -155,6 +395,12 @@ class Workplanner():
                 self.p2fld_out = self.p2fld_out / '{year}'
 
         self.date_from_name = date_from_name
+        if date_regex is not None:
+            date_regex = re.compile(date_regex)
+            if date_regex.groups == 0:
+                raise ValueError(f'date_regex needs a group that captures the date, e.g. (?P<date>...), got {date_regex.pattern}')
+        self.date_regex = date_regex
+        self.date_format = date_format
         self.glob_pattern_in = glob_pattern_in
         if isinstance(reporter, type(None)):
             self.reporter = prodlab.Reporter()
@@ -163,33 +409,78 @@ class Workplanner():
         else:
             raise TypeError(f'reporter must be a prodlab.Reporter or None, got {type(reporter)}')
         self.verbose = verbose
+        if existence_engine not in ['scandir', 'stat']:
+            raise ValueError(f'existence_engine must be either "scandir" or "stat", got {existence_engine}')
+        self.existence_engine = existence_engine
+        if scan_manifest is None:
+            self.scan_manifest = None
+        else:
+            self.scan_manifest = prodcache.ScanManifest(str(scan_manifest).format(**kwargs))
+        self.attribute_cache = prodcache.AttributeCache(None if attribute_cache is None else str(attribute_cache).format(**kwargs))
+        self.ledger = None if ledger is None else prodledger.InputLedger(str(ledger).format(**kwargs))
+        self.compact_masterplan = compact_masterplan
+        if failures is None:
+            self.failures = None
+        else:
+            self.failures = prodledger.FailureRegistry(str(failures).format(**kwargs), max_attempts = max_attempts, backoff = backoff)
+        self._failing = set()
+        self.history = None if history is None else prodledger.RowHistory(str(history).format(**kwargs))
+        self._history_peaks = {}
+        self._memory_ratio = 2
+        self._measure_rss = False
+        self.queue = None if queue is None else prodqueue.LeaseQueue(str(queue).format(**kwargs), lease_time = lease_time)
 
         self._processing_start = start
         self._processing_end = end
 
         self._masterplan = None   
+        self._workplan = None
+        self._workplan_time = None
+        self._processed = set()
+        self._prefetched = {}
+        self._carry = None
+        self.progress = None
 
-    def _read_database(self):
-        # read the datacolumn from the database
+    def _read_database(self, start = None, end = None):
+        """Read the date (and file path) column from the database. 
+        If start and end are given, only rows between them are selected (see the database parameter)."""
         def connect(path2database):
             conn = sqlite3.connect(path2database)
             conn.row_factory = sqlite3.Row
             return conn
         path2database, table_name, date_column, p2f_column = self.database
+        columns = [date_column] if p2f_column == 'None' else [date_column, p2f_column]
+        query = f'SELECT {", ".join(columns)} FROM {table_name}'
+        params = []
+        window = None
+        if start is not None and end is not None:
+            # whole days with a margin, which works for "YYYY-mm-dd HH:MM:SS" as well as "YYYY-mm-ddTHH:MM:SS"
+            window = (start.normalize() - pd.Timedelta(days = 1), end.normalize() + pd.Timedelta(days = 2))
         with connect(path2database) as conn:
-            df = pd.read_sql_query(
-                f'SELECT * FROM {table_name}',# ORDER BY {date_column} DESC',
-                conn,
-                # index_col='row_timestamp',
-            )
-        if len(df) == 0:
+            if self.database_create_index:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_{date_column} ON {table_name} ({date_column})')
+            if window is not None:
+                # Range filtering in SQL compares strings, so only do it if the dates are stored as ISO text.
+                sample = conn.execute(f'SELECT {date_column} FROM {table_name} LIMIT 1').fetchone()
+                if sample is None or not isinstance(sample[0], str):
+                    window = None
+                elif re.match(r'^\d{4}-\d{2}-\d{2}', sample[0]):
+                    query += f' WHERE {date_column} >= ? AND {date_column} < ?'
+                    params = [f'{window[0]:%Y-%m-%d}', f'{window[1]:%Y-%m-%d}']
+            df = pd.read_sql_query(query, conn, params = params)
+        if len(df) == 0 and len(params) == 0:
             print(f'Warning: Database {path2database} table {table_name} is empty.')
             return None
+        df.index = pd.to_datetime(df[date_column])
+        if window is not None and len(params) == 0:
+            # other text formats (e.g. YYYYmmdd) are filtered after parsing
+            df = df[(df.index >= window[0]) & (df.index < window[1])].copy()
+        if len(df) == 0:
+            return None
         if p2f_column == 'None':
             df['in_database'] = True
         else:
-            df['in_database'] = df.apply(lambda row: pl.Path(row[p2f_column]).name, axis = 1)
-        df.index  = df.apply(lambda row: pd.to_datetime(row[date_column]), axis = 1)
+            df['in_database'] = df[p2f_column].astype(str).str.rsplit('/', n = 1).str[-1]
         df.sort_index(inplace=True)
         return df
 
@@ -198,7 +489,9 @@ class Workplanner():
         if isinstance(self._processing_start, type(None)):
             if self.verbose:
                 print(f'Get all files in {self.p2fld_in} with glob pattern: {self.glob_pattern_in}')
-            if self.input_directory_structure == 'yearly':
+            if self.scan_manifest is not None:
+                gen = self.scan_manifest.glob(self.p2fld_in, self.glob_pattern_in, yearly = self.input_directory_structure == 'yearly')
+            elif self.input_directory_structure == 'yearly':
                 gen = self.p2fld_in.glob(f"*/{self.glob_pattern_in}")
             else:
                 gen = self.p2fld_in.glob(self.glob_pattern_in)
@@ -207,10 +500,165 @@ class Workplanner():
             end = pd.to_datetime(self._processing_end) if not isinstance(self._processing_end, type(None)) else pd.Timestamp.now()
             if self.verbose:
                 print(f'Get all files in {self.p2fld_in} with "files_between" function and start: {start}, end: {end} and glob pattern: {self.glob_pattern_in}')
-            gen = files_between(self.p2fld_in, start, end, globpattern = self.glob_pattern_in, input_directory_structure = self.input_directory_structure)
+            gen = files_between(self.p2fld_in, start, end, globpattern = self.glob_pattern_in, input_directory_structure = self.input_directory_structure,
+                                method = 'scan', listdir = None if self.scan_manifest is None else self.scan_manifest.listdir)
         df  = pd.DataFrame(gen, columns=['p2f_in'])
+        if self.scan_manifest is not None:
+            self.scan_manifest.save()
         return df
 
+    def _dates_from_names(self, names):
+        """Get the dates from a list of file names (names only, not the entire path).
+        Uses date_regex/date_format if set, otherwise falls back to date_from_name."""
+        if self.date_regex is None:
+            # element-wise like before, a single to_datetime call would infer one format from the 
+            # first name and fail for archives whose naming changed over time
+            return pd.DatetimeIndex([pd.to_datetime(self.date_from_name(name)) for name in names])
+        
+        extracted = pd.Series(names, dtype = object).str.extract(self.date_regex, expand = True)
+        group = 'date' if 'date' in extracted.columns else extracted.columns[0]
+        dates = pd.to_datetime(extracted[group], format = self.date_format)
+        if dates.isna().any():
+            bad = extracted[group].isna() | dates.isna()
+            raise ValueError(f'date_regex ({self.date_regex.pattern}) did not give a date for {bad.sum()} file names, e.g. {names[bad.to_numpy().argmax()]}')
+        return pd.DatetimeIndex(dates)
+
+    def _get_input_table(self):
+        """All input files, indexed and sorted by their date. With compact_masterplan the paths are 
+        stored as directory (categorical, in_dir) and file name (in_name) instead of p2f_in."""
+        if not self.compact_masterplan:
+            df = self._get_input_files()
+            df.index = self._dates_from_names([p.name for p in df.p2f_in])
+        else:
+            # one directory at a time, so Path objects only exist for one directory
+            parts = [pd.DataFrame({'in_dir': str(batch.p2f_in.iloc[0].parent),
+                                   'in_name': [p.name for p in batch.p2f_in]}, index = batch.index)
+                     for batch in self._iter_input_batches()]
+            if len(parts) == 0:
+                df = pd.DataFrame({'in_dir': [], 'in_name': []}, index = pd.DatetimeIndex([]))
+            else:
+                df = pd.concat(parts)
+            df['in_dir'] = df.in_dir.astype('category')
+            df['in_name'] = df.in_name.astype('string')
+        df.sort_index(inplace = True, kind = 'stable')
+        return df
+
+    def _output_paths(self, index, as_path = True):
+        """Output file paths (output_file_format) for the timestamps in index."""
+        output_path_format = str(self.p2fld_out.joinpath(self.output_file_format))
+        to_path = pl.Path if as_path else str
+        return [
+            to_path(output_path_format.format(
+                date=timestamp.strftime("%Y%m%d"),
+                year=timestamp.strftime("%Y"),
+                month=timestamp.strftime("%m"),
+                day=timestamp.strftime("%d"),
+                **self.kwargs,
+            ))
+            for timestamp in index
+        ]
+
+    def _iter_input_batches(self):
+        """Like _get_input_files, but yields one DataFrame per input directory (year directory 
+        or flat root) in ascending order, indexed and sorted by the date of the files."""
+        if self.scan_manifest is not None:
+            listdir = self.scan_manifest.listdir
+        else:
+            listdir = lambda folder, pattern: fnmatch.filter(os.listdir(folder), pattern)
+
+        if isinstance(self._processing_start, type(None)):
+            if self.input_directory_structure == 'yearly':
+                if self.scan_manifest is not None:
+                    subdirs = self.scan_manifest.subdirs(self.p2fld_in)
+                else:
+                    subdirs = [de.name for de in os.scandir(self.p2fld_in) if de.is_dir()]
+                folders = [self.p2fld_in / sub for sub in sorted(subdirs)]
+            else:
+                folders = [self.p2fld_in]
+            batches = ([folder / name for name in listdir(folder, self.glob_pattern_in)] for folder in folders)
+        else:
+            start = pd.to_datetime(self._processing_start)
+            end = pd.to_datetime(self._processing_end) if not isinstance(self._processing_end, type(None)) else pd.Timestamp.now()
+            gen = files_between(self.p2fld_in, start, end, globpattern = self.glob_pattern_in, input_directory_structure = self.input_directory_structure,
+                                method = 'scan', listdir = None if self.scan_manifest is None else lambda folder: self.scan_manifest.listdir(folder))
+            batches = (list(paths) for folder, paths in itertools.groupby(gen, key = lambda p: p.parent))
+
+        for paths in batches:
+            if len(paths) == 0:
+                continue
+            df = pd.DataFrame({'p2f_in': paths})
+            df.index = self._dates_from_names([p.name for p in paths])
+            df.sort_index(inplace = True, kind = 'stable')
+            yield df
+        if self.scan_manifest is not None:
+            self.scan_manifest.save()
+
+    def _iter_masterplan_batches(self):
+        """Yields the masterplan in consecutive pieces (one per input directory)."""
+        if self.p2fld_out is None:
+            raise ValueError('Streaming is only implemented for p2fld_out, not for database.')
+        if self.p2fld_in is None:
+            days = pd.date_range(pd.to_datetime(self._processing_start), pd.to_datetime(self._processing_end), freq = 'D')
+            for year in days.year.unique():
+                batch = pd.DataFrame(index = days[days.year == year])
+                batch['p2f_out'] = self._output_paths(batch.index)
+                yield batch
+            return
+        for batch in self._iter_input_batches():
+            batch['p2f_out'] = self._output_paths(batch.index)
+            yield batch
+
+    def _check_existing_run(self, run):
+        """Return the rows of a run of existing output files (ascending) that are incomplete and 
+        need reprocessing. Like in the workplan, files are checked newest -> oldest until the first 
+        complete one."""
+        if not self.file_complete_check:
+            return []
+        incomplete = []
+        for idx, row in reversed(run):
+            if self._day_complete(row.p2f_out):
+                break
+            incomplete.append((idx, row))
+        return incomplete[::-1]
+
+    def iter_workplan(self, max_run = 100):
+        """Streaming version of the workplan. Consumes the input directories in date order and 
+        yields (idx, row) for each row that needs processing as soon as it is known, so processing can 
+        start before the whole archive has been scanned. Memory is bounded by the size of one input 
+        directory.
+
+        In contrast to workplan, the file complete check is done for each run of existing output files 
+        that is followed by a gap (not just the trailing run), as it is not known whether later files 
+        exist when the gap is reached.
+
+        Parameters
+        ----------
+        max_run : int, optional
+            Maximum number of existing rows (newest) that are kept for the file complete check of a run. 
+            The default is 100.
+        """
+        run = collections.deque(maxlen = max_run)
+        for batch in self._iter_masterplan_batches():
+            batch = batch.dropna()
+            exists = self._outputs_done(batch)
+            for (idx, row), row_exists in zip(batch.iterrows(), exists):
+                if row_exists:
+                    run.append((idx, row))
+                    continue
+                yield from self._check_existing_run(run)
+                run.clear()
+                yield idx, row
+        yield from self._check_existing_run(run)
+        self.attribute_cache.save()
+
+    def invalidate_scan_manifest(self):
+        """Delete the scan manifest so the next run lists all input directories again."""
+        if self.scan_manifest is None:
+            print('No scan manifest set, nothing to invalidate.')
+            return
+        self.scan_manifest.invalidate()
+        self.refresh()
+
     def _make_master(self):
             if self.p2fld_in is None:
                 df1 = pd.DataFrame(index=pd.date_range(
@@ -219,28 +667,28 @@ class Workplanner():
                     freq='D',
                 ))
             else:
-                df1 = self._get_input_files()
-                df1.index = df1.apply(lambda row: pd.to_datetime(self.date_from_name(row.p2f_in.name)), axis = 1)
-                df1.sort_index(inplace=True)
+                df1 = self._get_input_table()
             mp = df1      
             if self.p2fld_out is not None:          
-                output_path_format = str(self.p2fld_out.joinpath(self.output_file_format))
-                mp['p2f_out'] = [
-                    pl.Path(output_path_format.format(
-                        date=timestamp.strftime("%Y%m%d"),
-                        year=timestamp.strftime("%Y"),
-                        month=timestamp.strftime("%m"),
-                        day=timestamp.strftime("%d"),
-                        **self.kwargs,
-                    ))
-                    for timestamp in mp.index
-                ]
+                if not self.compact_masterplan:
+                    mp['p2f_out'] = self._output_paths(mp.index)
             elif self.database is not None:
-                df = self._read_database()
+                if len(mp) == 0:
+                    df = None
+                else:
+                    df = self._read_database(start = mp.index.min(), end = mp.index.max())
+                path2database, table_name, date_column, p2f_column = self.database
+                # anti-join: is the timestamp (or the file name) of a masterplan row in the database
                 if df is None:
-                    mp['in_database'] = None
+                    mp['in_database'] = False
+                elif p2f_column == 'None':
+                    mp['in_database'] = mp.index.isin(df.index)
                 else:
-                    mp['in_database'] = df.in_database
+                    if self.compact_masterplan:
+                        names = mp.in_name
+                    else:
+                        names = pd.Series([p.name for p in mp.p2f_in], index = mp.index, dtype = object)
+                    mp['in_database'] = names.isin(set(df.in_database))
             else:
                 raise ValueError('Either p2fld_out or database must be set.')    
             assert(mp.index.is_monotonic_increasing), 'Masterplan index is not monotonic increasing, check the date parsing from the file names.'
@@ -251,7 +699,7 @@ class Workplanner():
         """Combine master-plan rows that share the same timestamp."""
         if isinstance(self._masterplan, type(None)):
             self._make_master()
-        mp = self._masterplan
+        mp = self._materialize(self._masterplan)
         if mp.index.is_unique:
             if self.verbose:
                 print('Masterplan index is already unique, no need to combine duplicates.')
@@ -270,6 +718,7 @@ class Workplanner():
         else:
             raise ValueError('Either p2fld_out or database must be set.')
         self._masterplan = combined.sort_index()
+        self._workplan = None
         return self._masterplan
 
     @property
@@ -287,12 +736,87 @@ class Workplanner():
             assert(mp.index.is_unique), 'Masterplan index is not unique. Consider running the combine_masterplan_duplicates or use the WorkplannerDaily class, which allows truncating files that contribute to multiple days to daily files.'
         return self._masterplan
 
+    def refresh(self):
+        """Forget the cached masterplan and workplan, they will be recomputed on the next access."""
+        self._masterplan = None
+        self._workplan = None
+        self._processed = set()
+
+    def _mark_processed(self, idx):
+        """Remove a successfully processed row from the cached workplan (applied lazily on the next workplan access)."""
+        self._processed.add(idx)
+
     @property
     def workplan(self):
+        """The rows of the masterplan that still need processing.
+        The workplan is computed only once (this involves checking the existence of
+        all output files) and cached. Rows processed by the process method are 
+        removed from the cache. Call refresh to force a recomputation."""
+        if self._workplan is None:
+            self._workplan_time = time.time()
+            self._workplan = self._materialize(self._make_workplan())
+            self._processed = set()
+        elif len(self._processed) > 0:
+            self._workplan = self._workplan.drop(index = list(self._processed), errors = 'ignore')
+            self._processed = set()
+        return self._workplan
+
+    @workplan.setter
+    def workplan(self, workplan):
+        self._workplan = workplan
+        self._workplan_time = time.time()
+        self._processed = set()
+
+    def _materialize(self, df):
+        """Turn (a part of) the masterplan into rows as they are handed to process_row, i.e. build the 
+        path columns of a compact masterplan."""
+        if 'in_name' in df.columns:
+            df = df.copy()
+            df.insert(0, 'p2f_in', [pl.Path(d) / n for d, n in zip(df.in_dir, df.in_name)])
+            df = df.drop(['in_dir', 'in_name'], axis = 1)
+        if self.p2fld_out is not None and 'p2f_out' not in df.columns:
+            df = df.copy()
+            df.insert(1 if 'p2f_in' in df.columns else 0, 'p2f_out', self._output_paths(df.index))
+        return df
+
+    def _outputs_exist(self, wp):
+        """Boolean series (aligned with wp) telling which output files exist."""
+        if 'p2f_out' in wp.columns:
+            p2fs_out = wp.p2f_out
+        else:
+            p2fs_out = self._output_paths(wp.index, as_path = False)
+        if self.existence_engine == 'stat':
+            return pd.Series([os.path.isfile(p) for p in p2fs_out], index = wp.index, dtype = bool)
+        return pd.Series(files_exist(p2fs_out), index = wp.index, dtype = bool)
+
+    def _outputs_done(self, wp):
+        """Boolean series (aligned with wp) telling which rows do not need processing: the output 
+        file exists and, if a ledger is used, the inputs did not change since."""
+        done = self._outputs_exist(wp)
+        if self.ledger is not None and done.any():
+            rows = self._materialize(wp[done])
+            if 'p2f_in' not in rows.columns:
+                return done
+            changed = self.ledger.changed(rows, product_version = getattr(self, 'version', None))
+            if self.verbose and changed.any():
+                print(f'{changed.sum()} rows have changed inputs and will be re-processed.')
+            done[changed[changed].index] = False
+        return done
+
+    def _day_complete(self, p2f_out):
+        """Read the day_complete attribute of an output file (header only, cached)."""
+        attrs = self.attribute_cache.get(p2f_out)
+        if 'day_complete' not in attrs:
+            raise AttributeError(f'File complete check is enabled, but the day_complete attribute is missing in processed file {p2f_out}. Add "attrs["day_complete"] = row.day_complete.__str__()" to the process_row method of your Workplanner subclass to fix this. You will also need to remove the previous file or somehow add the attribute to it.')
+        dc = str(attrs['day_complete']).strip().lower()
+        assert(dc in ['true','false']), f'day_complete needs to be True or False, found {dc}.'
+        return dc == 'true'
+
+    def _make_workplan(self):
         if self.p2fld_out is not None:
             # Files that don't exist must be processed.
             wp = self.masterplan.dropna()
-            exists = wp.p2f_out.apply(lambda p: p.is_file())
+            exists = self._outputs_done(wp)
             where_reprocess = ~exists
 
             # If disabled, don't open any files.
@@ -300,28 +824,18 @@ class Workplanner():
                 return wp[where_reprocess]
 
             # Check only trailing existing files (newest -> oldest) until first complete day.
-            for idx, row in wp[exists].iloc[::-1].iterrows():
-                with xr.open_dataset(row.p2f_out) as ds:
-                    assert hasattr(ds, "day_complete"), (
-                    f"Input files need a day_complete attribute for file-complete checks. Missing in {row.p2f_out}"
-                    )
-                    dc = ds.day_complete
-                    complete = dc.strip().lower() == "true"
-
+            for idx in wp.index[exists][::-1]:
+                complete = self._day_complete(self._output_paths([idx])[0])
                 if complete:
                     break  # older files are assumed already complete
                 else:
                     where_reprocess.loc[idx] = True  # reprocess incomplete trailing file(s)
+            self.attribute_cache.save()
             return wp[where_reprocess]
 
         elif self.database is not None:
             mp = self.masterplan 
-            path2database, table_name, date_column, p2f_column = self.database
-            if p2f_column == 'None':
-                in_db = ~self.masterplan.in_database.isna()
-            else:
-                in_db = mp.apply(lambda row: row.p2f_in.name == row.in_database, axis = 1)
-            wp = mp[~in_db]
+            wp = mp[~mp.in_database.astype(bool)]
             wp = wp.drop('in_database', axis = 1)
             return wp
         else:
@@ -375,21 +889,21 @@ class Workplanner():
         self.tp_row = row
 
         #####
-        # get last processed instance - usefull if processing depends on the previous day
+        # get the state of the previous row - usefull if processing depends on the previous day.
+        # In a sequential run this is what the previous row handed over with set_carry (see 
+        # below), only the first row of a run reads it from disk (load_state).
         ######
-        lastrow = self.get_last_row_before_workplan()
-        if isinstance(lastrow, type(None)):
+        dslast = self.get_previous_state(row)
+        if isinstance(dslast, type(None)):
             assert(False), 'set defaults?'
-        dslast = xr.open_dataset(lastrow.p2f_out)
 
         #######
-        ## Open input files
+        ## Open input files (prefetched in the background if process is called with prefetch > 0)
         #######
+        ds = self.get_inputs(row)
         if isinstance(row.p2f_in, list):
-            ds = xr.open_mfdataset(row.p2f_in)
             input_files = ','.join(str(p) for p in row.p2f_in)
         else:
-            ds = xr.open_dataset(row.p2f_in)
             input_files = str(row.p2f_in)
 
         ## Do some processing here, e.g. add attributes, format the dataset, etc.
@@ -415,29 +929,664 @@ class Workplanner():
         ds.attrs['product_version'] = self.version
         ## Save the output file
         if save:
-            ds.to_netcdf(row.p2f_out)
+            self.write_output(ds, row)
+        ## Hand the state over to the next row, keep it small, e.g. ds.isel(time = -1)
+        self.set_carry(row, ds)
         ds.close()
         return ds
 
+    def write_output(self, ds, row):
+        """Write the dataset of a row to row.p2f_out (atomically, see write_netcdf_atomic). This is 
+        what runs in the background when process is called with write_behind > 0. Overwrite this 
+        to pass encodings or to write other formats."""
+        write_netcdf_atomic(ds, row.p2f_out)
+
     
-    def process(self, raise_errors = False):
-        si = None
-        for idx, row in self.workplan.iterrows():
+    def set_carry(self, row, state):
+        """Hand a state (e.g. the last time step of the dataset of row) over to the next row, 
+        which gets it from get_previous_state without reading it from disk."""
+        self._carry = (row.name, state)
+
+    def get_previous_state(self, row):
+        """The state of the row before row (in the masterplan), None if row is the first one.
+        This is what the previous row passed to set_carry if it was processed in this run, 
+        otherwise (e.g. the first row of a run) the state is read from disk by load_state."""
+        loc = self.masterplan.index.get_loc(row.name)
+        if not isinstance(loc, (int, np.integer)):
+            raise ValueError(f'The masterplan index is not unique at {row.name}, the previous row is not defined.')
+        if loc == 0:
+            return None
+        if self._carry is not None and self._carry[0] == self.masterplan.index[loc - 1]:
+            return self._carry[1]
+        lastrow = self._materialize(self.masterplan.iloc[[loc - 1]]).iloc[0]
+        return self.load_state(lastrow)
+
+    def load_state(self, lastrow):
+        """Read the state of lastrow from disk, by default its output file (loaded into memory). 
+        None if the file does not exist. Overwrite this together with the state you pass to 
+        set_carry, if you only need a part of the file."""
+        if 'p2f_out' not in lastrow.index or not os.path.isfile(lastrow.p2f_out):
+            return None
+        with xr.open_dataset(lastrow.p2f_out) as ds:
+            return ds.load()
+
+    def load_inputs(self, row):
+        """Open and load the input file(s) of a row. Overwrite this if your inputs are not netcdf files.
+        This is what runs in the background when process is called with prefetch > 0, so the data 
+        should be loaded into memory, not just opened lazily."""
+        if isinstance(row.p2f_in, list):
+            with xr.open_mfdataset(row.p2f_in) as ds:
+                return ds.load()
+        else:
+            with xr.open_dataset(row.p2f_in) as ds:
+                return ds.load()
+
+    def get_inputs(self, row):
+        """Inputs of a row (see load_inputs). Use this in process_row: if the inputs have been 
+        prefetched they are taken from the prefetch stage, otherwise they are loaded now."""
+        future = self._prefetched.get(row.name)
+        if future is not None:
+            return future.result()
+        return self.load_inputs(row)
+
+    def _input_size(self, row):
+        """Size of the input file(s) of a row in bytes."""
+        if 'p2f_in' not in row.index:
+            return 0
+        p2fs = row.p2f_in if isinstance(row.p2f_in, list) else [row.p2f_in]
+        size = 0
+        for p2f in p2fs:
             try:
-                si = self.process_row(row)
+                size += os.stat(p2f).st_size
+            except (FileNotFoundError, TypeError):
+                continue
+        return size
+
+    def _prefetch(self, rows, max_rows, max_bytes = None):
+        """Wrap the row iterator so the inputs of the next max_rows rows are loaded in background 
+        threads while the current row is processed. If max_bytes is set, rows are only read ahead 
+        as long as the summed input file size stays below it (at least one row is always read ahead)."""
+        pool = cf.ThreadPoolExecutor(max_workers = max_rows)
+        ahead = collections.deque() # (idx, row, future, nbytes)
+        ahead_bytes = 0
+        upcoming = None
+        rows = iter(rows)
+        try:
+            while True:
+                while len(ahead) < max_rows:
+                    if upcoming is None:
+                        upcoming = next(rows, None)
+                        if upcoming is None:
+                            break
+                        nbytes = self._input_size(upcoming[1])
+                    if max_bytes is not None and len(ahead) > 0 and ahead_bytes + nbytes > max_bytes:
+                        break
+                    idx, row = upcoming
+                    ahead.append((idx, row, pool.submit(self.load_inputs, row), nbytes))
+                    ahead_bytes += nbytes
+                    upcoming = None
+                if len(ahead) == 0:
+                    break
+                idx, row, future, nbytes = ahead.popleft()
+                ahead_bytes -= nbytes
+                self._prefetched[idx] = future
+                try:
+                    yield idx, row
+                finally:
+                    self._prefetched.pop(idx, None)
+        finally:
+            pool.shutdown(wait = True, cancel_futures = True)
+
+    def _run_row(self, idx, row, raise_errors = False, save = True):
+        """Process a single row. Returns (success, return value of process_row).
+        With save = False, process_row is asked not to write the output and the row is not 
+        booked as done (see _write_behind)."""
+        rss_start = _reset_peak_rss() if self._measure_rss else None
+        if rss_start is None:
+            # peak RSS can not be measured per row, don't try again this run
+            self._measure_rss = False
+        start = time.perf_counter()
+        try:
+            result = self._call_process_row(row, save = save)
+            if not save:
+                if result is None:
+                    raise TypeError('process_row needs to return the dataset when write_behind is used, got None.')
+        except Exception as e:
+            return self._row_error(idx, row, e, start, raise_errors)
+        return self._row_success(idx, row, result, start, rss_start, save)
+
+    async def _arun_row(self, idx, row, raise_errors = False, threads = None):
+        """Async version of _run_row. Coroutine process_row implementations are awaited, others 
+        run in threads (the executor threads, the default executor of the loop if None)."""
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(self.process_row):
+                result = self._call_process_row(row)
+                if inspect.isawaitable(result):
+                    result = await result
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(threads, self._call_process_row, row)
+        except Exception as e:
+            return self._row_error(idx, row, e, start, raise_errors)
+        return self._row_success(idx, row, result, start, None, True)
+
+    def _row_error(self, idx, row, e, start, raise_errors):
+        self.reporter.record('row', time.perf_counter() - start)
+        self._row_failed(idx, row, e)
+        if raise_errors:
+            raise e
+        print(f'Error occurred while processing row {idx}: {e}')
+        return False, None
+
+    def _row_success(self, idx, row, result, start, rss_start, save):
+        duration = time.perf_counter() - start
+        self.reporter.record('row', duration)
+        peak = None
+        if rss_start is not None:
+            peak = max(0, _memory_status()[1] - rss_start)
+            self.reporter.record('rss_MB', peak / 1e6)
+        if self.history is not None:
+            self.history.record(self._row_key(idx, row), input_bytes = self._input_size(row), peak_rss = peak, duration = duration)
+        if save:
+            self._row_done(idx, row)
+        return True, result
+
+    def _call_process_row(self, row, save = True):
+        if save:
+            return self.process_row(row)
+        return self.process_row(row, save = False)
+
+    def _row_failed(self, idx, row, e):
+        # the next row can not build on this one
+        self._carry = None
+        if self.queue is not None:
+            self.queue.release(self._row_key(idx, row))
+        if self.failures is not None:
+            if self.failures.record(self._row_key(idx, row), e):
+                print(f'Row {idx} failed {self.failures.max_attempts} times and is quarantined.')
+
+    def _row_done(self, idx, row):
+        if self.ledger is not None and 'p2f_in' in row.index and 'p2f_out' in row.index:
+            self.ledger.record(row.p2f_out, row.p2f_in, product_version = getattr(self, 'version', None))
+        if self.queue is not None:
+            self.queue.done(self._row_key(idx, row))
+        if self.failures is not None and self._row_key(idx, row) in self._failing:
+            self.failures.clear(self._row_key(idx, row))
+        print('.', end = '')
+
+    def _write_row(self, idx, row, ds):
+        with self.reporter.phase('write'):
+            self.write_output(ds, row)
+        return idx, row
+
+    def _write_behind(self, rows, n_writers, raise_errors = False):
+        """Run process_row (with save = False) on rows and hand the returned datasets to a pool of 
+        n_writers background threads that write them (write_output). Only 2 * n_writers datasets are 
+        kept in memory, processing waits if the writers fall behind. A row counts as clean when its 
+        file is written. Returns the last dataset."""
+        pool = cf.ThreadPoolExecutor(max_workers = n_writers)
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                idx, row = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    self._row_failed(idx, row, e)
+                    if raise_errors:
+                        raise e
+                    print(f'Error occurred while writing row {idx}: {e}')
+                    self.reporter.errors_increment()
+                    self._count_progress()
+                    continue
+                self._row_done(idx, row)
                 self.reporter.clean_increment()
+                self._mark_processed(idx)
+                self._count_progress()
 
-            except Exception as e:
-                if raise_errors:
-                    raise e
-                else:
-                    print(f'Error occurred while processing row {idx}: {e}')
+        si = None
+        try:
+            for idx, row in rows:
+                success, ds = self._run_row(idx, row, raise_errors = raise_errors, save = False)
+                if not success:
                     self.reporter.errors_increment()
+                    self._count_progress()
                     continue
-            
-            print('.', end = '')
+                si = ds
+                if len(pending) >= 2 * n_writers:
+                    done, _ = cf.wait(pending, return_when = cf.FIRST_COMPLETED)
+                    collect(done)
+                pending[pool.submit(self._write_row, idx, row, ds)] = (idx, row)
+            done, _ = cf.wait(pending)
+            collect(done)
+        finally:
+            pool.shutdown(wait = True, cancel_futures = True)
         return si
 
+    def _order_workplan(self, wp, order):
+        """Sort the workplan according to the order policy (see process)."""
+        if callable(order):
+            priority = np.asarray(order(wp))
+            if len(priority) != len(wp):
+                raise ValueError(f'order returned {len(priority)} priorities for {len(wp)} rows.')
+            return wp.iloc[np.argsort(-priority, kind = 'stable')]
+        if order == 'ascending':
+            return wp
+        if order == 'newest':
+            return wp.iloc[::-1]
+        if order == 'gaps':
+            if len(wp) == 0:
+                return wp
+            # consecutive rows of the masterplan that are missing form a gap
+            pos = self.masterplan.index.get_indexer(wp.index)
+            gap = np.cumsum(np.diff(pos, prepend = pos[0] - 2) != 1)
+            gap_length = np.array(pd.Series(gap).map(pd.Series(gap).value_counts()))
+            gap_length[np.argmax(pos)] = 0 # the newest row goes first
+            return wp.iloc[np.lexsort((-pos, gap_length))]
+        raise ValueError(f'order must be "ascending", "newest", "gaps" or a callable, got {order}')
+
+    def _until(self, rows, deadline, total = None):
+        """Stop yielding rows when the next row is not expected to finish before deadline."""
+        for i, (idx, row) in enumerate(rows):
+            summary = self.reporter.timings.get('row')
+            expected = 0 if summary is None or summary.count == 0 else summary.quantile(0.95)
+            if pd.Timestamp.now() + pd.to_timedelta(expected, unit = 's') > deadline:
+                left = '' if total is None else f' ({total - i} rows left)'
+                msg = f'stopped before row {idx} to meet the deadline {deadline}{left}'
+                print(f'\n{msg}')
+                self.reporter.add_comment(msg)
+                return
+            yield idx, row
+
+    def estimate_memory(self, row):
+        """Expected memory footprint of processing row in bytes: the peak RSS it had on an earlier 
+        run (row history), otherwise the size of its input files times the median ratio of peak RSS 
+        to input size of the recorded rows (2 if nothing is recorded). Overwrite this if you know better."""
+        peak = self._history_peaks.get(self._row_key(row.name, row))
+        if peak is not None:
+            return peak
+        return self._input_size(row) * self._memory_ratio
+
+    def _row_key(self, idx, row):
+        """Key of a row in the work queue and failure registry: the output file if there is one, the index otherwise."""
+        if 'p2f_out' in row.index:
+            return str(row.p2f_out)
+        return str(idx)
+
+    def _row_keys(self, wp):
+        """_row_key for all rows of wp (pandas.Series aligned with wp)."""
+        if 'p2f_out' in wp.columns:
+            return wp.p2f_out.astype(str)
+        return pd.Series([str(idx) for idx in wp.index], index = wp.index, dtype = object)
+
+    @property
+    def quarantine(self):
+        """Rows that failed too often and are no longer processed (DataFrame indexed by row key)."""
+        if self.failures is None:
+            raise ValueError('No failure registry, set failures when creating the Workplanner.')
+        return self.failures.quarantine
+
+    def release_quarantine(self, keys = None):
+        """Release rows (keys as in the quarantine, all if None) from the quarantine, so they are 
+        processed again."""
+        if self.failures is None:
+            raise ValueError('No failure registry, set failures when creating the Workplanner.')
+        return self.failures.release_quarantine(keys)
+
+    def _skip_blocked(self, rows):
+        """Skip rows that are backing off after a failure or are quarantined."""
+        blocked = self.failures.blocked()
+        skipped = 0
+        for idx, row in rows:
+            if self._row_key(idx, row) in blocked:
+                skipped += 1
+                continue
+            yield idx, row
+        if skipped > 0:
+            print(f'{skipped} rows were skipped as they failed before (backing off or quarantined).')
+
+    def _claim(self, rows, planned):
+        """Only yield the rows that could be claimed in the work queue, i.e. that are not being 
+        processed by another run and were not done since planned."""
+        skipped = 0
+        for idx, row in rows:
+            if self.queue.claim(self._row_key(idx, row), planned = planned):
+                yield idx, row
+            else:
+                skipped += 1
+                self._mark_processed(idx)
+        if self.verbose and skipped > 0:
+            print(f'{skipped} rows were skipped as they are processed or done by another run.')
+
+    def _planned_rows(self, stream, order, max_runtime, deadline):
+        """The (idx, row) iterator for process and aprocess with the ordering, deadline, failure 
+        and work queue stages applied, and the heartbeat context of the work queue."""
+        if max_runtime is not None:
+            if not isinstance(max_runtime, pd.Timedelta):
+                max_runtime = pd.to_timedelta(max_runtime, unit = 's')
+            end = pd.Timestamp.now() + max_runtime
+            deadline = end if deadline is None else min(pd.to_datetime(deadline), end)
+        elif deadline is not None:
+            deadline = pd.to_datetime(deadline)
+
+        if stream:
+            if order != 'ascending':
+                raise ValueError(f'Only order = "ascending" is possible when streaming, got {order}.')
+            planned = time.time()
+            rows = self.iter_workplan()
+            total = None
+        else:
+            wp = self._order_workplan(self.workplan, order)
+            rows = wp.iterrows()
+            total = len(wp)
+            planned = self._workplan_time
+
+        if deadline is not None:
+            rows = self._until(rows, deadline, total)
+
+        self._carry = None
+        self.progress = prodlab.Throughput(total)
+        self._progress_printed = time.time()
+        if self.history is not None:
+            self._history_peaks = self.history.peaks()
+            ratio = self.history.memory_ratio()
+            self._memory_ratio = 2 if ratio is None else ratio
+        if self.failures is not None:
+            self._failing = self.failures.keys()
+            rows = self._skip_blocked(rows)
+        if self.queue is not None:
+            rows = self._claim(rows, planned)
+            heartbeat = self.queue.heartbeat()
+        else:
+            heartbeat = contextlib.nullcontext()
+        return rows, heartbeat
+
+    def _count_progress(self, n = 1):
+        """Count n finished rows in the throughput tracker, print it once a minute if verbose."""
+        self.progress.update(n)
+        if self.verbose and time.time() - self._progress_printed > 60:
+            print(f'\n{self.progress}')
+            self._progress_printed = time.time()
+
+    def forecast(self, n_workers = 1):
+        """Expected runtime for processing the current workplan, based on the durations of the 
+        rows on earlier runs (row history, see Workplanner). Rows without a recorded duration are 
+        assumed to take the median duration of the recorded rows. If there is no history, the 
+        median row time of this session (reporter) is used.
+
+        Parameters
+        ----------
+        n_workers : int, optional
+            Number of parallel workers (assumes perfect scaling). The default is 1.
+
+        Returns
+        -------
+        pandas.Series with the number of rows, the number of rows with a recorded duration, 
+        the typical duration of a row (s), the expected runtime and end time.
+        """
+        durations = {} if self.history is None else self.history.durations()
+        if len(durations) > 0:
+            typical = float(np.median(list(durations.values())))
+        elif 'row' in self.reporter.timings and self.reporter.timings['row'].count > 0:
+            typical = self.reporter.timings['row'].quantile(0.5)
+        else:
+            raise ValueError('No row durations are known. Set history when creating the Workplanner and process some rows first.')
+        wp = self.workplan
+        known = self._row_keys(wp).map(durations)
+        runtime = pd.to_timedelta(known.fillna(typical).sum() / n_workers, unit = 's')
+        return pd.Series(dict(rows = len(wp), 
+                              rows_known = int(known.notna().sum()), 
+                              seconds_per_row = typical, 
+                              runtime = runtime, 
+                              finished = pd.Timestamp.now() + runtime))
+
+    def process(self, raise_errors = False, n_workers = None, executor = 'process', chunksize = None, stream = False, 
+                prefetch = 0, prefetch_bytes = None, write_behind = 0, order = 'ascending', max_runtime = None, deadline = None,
+                memory_budget = None):
+        """Process all rows in the workplan.
+        The throughput (rows/s, smoothed) and the ETA are tracked in self.progress (see 
+        productomator.lab.Throughput) and printed once a minute if verbose. Use forecast to 
+        estimate the runtime before processing.
+
+        Parameters
+        ----------
+        raise_errors : bool, optional
+            If True, exceptions in process_row are raised instead of counted as errors.
+        n_workers : int, optional
+            Number of parallel workers. If None or 1, rows are processed one after 
+            the other in this process.
+        executor : str, optional
+            'process' (default) or 'thread'. Processes are forked, so the 
+            workplanner does not need to be picklable. Use 'thread' if process_row 
+            is mostly waiting for I/O.
+        chunksize : int, optional
+            Number of rows that are sent to a worker at once. Batching small rows 
+            reduces the pool overhead. By default the workplan is split into about 
+            4 chunks per worker (1 row per chunk when streaming).
+        stream : bool, optional
+            If True, rows are taken from iter_workplan, so processing starts while the
+            input directories are still being scanned.
+        prefetch : int, optional
+            Number of rows whose inputs are loaded (load_inputs) in background threads 
+            while the current row is processed. process_row gets them via get_inputs. 
+            Only in serial mode. The default is 0 (no prefetching).
+        prefetch_bytes : int, optional
+            Limits the prefetch stage to this many bytes of input files.
+        write_behind : int, optional
+            Number of background threads that write the outputs. process_row is called with 
+            save = False and needs to return the dataset, which is then written by write_output 
+            while the next row is processed. A row is only counted as clean once its file is 
+            written. Only in serial mode. As the netCDF library serializes writes, 1 is usually 
+            enough. The default is 0 (process_row writes the output itself).
+        order : str or callable, optional
+            Order in which the rows are processed.
+                ascending (default): oldest first.
+                newest: newest first, e.g. to get today's product out before working on a backlog.
+                gaps: the newest row first, then the gaps of the archive, short gaps (e.g. a single 
+                    missing day) before long ones, newest first within gaps of equal length.
+                callable: called with the workplan, returns a priority for each row (array-like, 
+                    aligned with the workplan). Rows with higher priority are processed first.
+            Only ascending is possible when streaming.
+        max_runtime : float or pandas.Timedelta, optional
+            Maximum runtime of this call (seconds if float). See deadline.
+        deadline : str or pandas.Timestamp, optional
+            Time by which processing has to be finished, e.g. the start of the next cron slot. A row 
+            is only started if it is expected to finish before the deadline (or before max_runtime is 
+            reached), based on the 95th percentile of the row times so far. Remaining rows are left 
+            for the next run, this is noted in the next log entry of the reporter. In parallel mode 
+            rows that are already submitted to the workers are finished.
+        memory_budget : int, optional
+            Maximum memory (bytes) the rows that are processed at the same time may use together (parallel 
+            mode only). The footprint of each row is estimated (estimate_memory) and rows are only handed to the 
+            workers while the sum of the rows in flight stays below the budget. A row that exceeds the 
+            budget on its own is processed when nothing else is in flight. The peak RSS of each row is 
+            recorded in the reporter as rss_MB (Linux only, not with executor = 'thread').
+
+        Returns
+        -------
+        The return value of the last process_row call in serial mode, None in
+        parallel mode (datasets are not sent back from the workers).
+        """
+        rows, heartbeat = self._planned_rows(stream, order, max_runtime, deadline)
+        self._measure_rss = _memory_status() is not None and not (executor == 'thread' and n_workers is not None and n_workers > 1)
+
+        if n_workers is None or n_workers <= 1:
+            if memory_budget is not None:
+                raise ValueError('memory_budget is only supported in parallel mode (n_workers > 1).')
+            if prefetch > 0:
+                rows = self._prefetch(rows, prefetch, max_bytes = prefetch_bytes)
+            if write_behind > 0:
+                with heartbeat:
+                    return self._write_behind(rows, write_behind, raise_errors = raise_errors)
+            si = None
+            with heartbeat:
+                for idx, row in rows:
+                    success, result = self._run_row(idx, row, raise_errors = raise_errors)
+                    if success:
+                        si = result
+                        self.reporter.clean_increment()
+                        self._mark_processed(idx)
+                    else:
+                        self.reporter.errors_increment()
+                    self._count_progress()
+            return si
+        
+        if prefetch > 0 or write_behind > 0:
+            raise ValueError('prefetch and write_behind are only supported in serial mode (n_workers = None).')
+        if memory_budget is not None and chunksize is None:
+            # rows are admitted per chunk, so keep them small
+            chunksize = 1
+        if chunksize is None:
+            chunksize = 1 if stream else max(1, -(-len(self.workplan) // (4 * n_workers)))
+        try:
+            with heartbeat:
+                self._process_parallel(rows, raise_errors, n_workers, executor, chunksize, memory_budget = memory_budget)
+        finally:
+            # the workers do not report back which rows they processed
+            self._workplan = None
+        return None
+
+    async def aprocess(self, raise_errors = False, concurrency = 10, stream = False, order = 'ascending', 
+                       max_runtime = None, deadline = None):
+        """Async version of process for process_row implementations that mostly wait (slow mounts, 
+        databases, web services). process_row can be a coroutine (async def), which is awaited, 
+        otherwise it runs in a pool of concurrency threads. Up to concurrency rows are processed at the same time. 
+        Counting in the reporter and error handling are the same as in process.
+
+        Example
+        -------
+        class Product(Workplanner):
+            async def process_row(self, row = None):
+                ...
+
+        asyncio.run(Product(...).aprocess(concurrency = 20))
+
+        Parameters
+        ----------
+        raise_errors : bool, optional
+            If True, the first exception in process_row is raised and the rows in flight are cancelled 
+            (a synchronous process_row that is already running in a thread can not be interrupted, 
+            it finishes in the background but is not counted).
+        concurrency : int, optional
+            Maximum number of rows processed at the same time. The default is 10.
+        stream, order, max_runtime, deadline : 
+            See process.
+
+        Returns
+        -------
+        The return value of the last process_row call that finished.
+        """
+        rows, heartbeat = self._planned_rows(stream, order, max_runtime, deadline)
+        self._measure_rss = False
+        slots = asyncio.Semaphore(concurrency)
+        threads = None if inspect.iscoroutinefunction(self.process_row) else cf.ThreadPoolExecutor(max_workers = concurrency)
+        tasks = set()
+        raised = []
+        si = None
+
+        async def run(idx, row):
+            nonlocal si
+            try:
+                success, result = await self._arun_row(idx, row, raise_errors = raise_errors, threads = threads)
+            except Exception as e:
+                raised.append(e)
+                return
+            finally:
+                slots.release()
+            if success:
+                si = result
+                self.reporter.clean_increment()
+                self._mark_processed(idx)
+            else:
+                self.reporter.errors_increment()
+            self._count_progress()
+
+        with heartbeat:
+            try:
+                for idx, row in rows:
+                    await slots.acquire()
+                    if len(raised) > 0:
+                        slots.release()
+                        break
+                    task = asyncio.create_task(run(idx, row))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                while len(tasks) > 0 and len(raised) == 0:
+                    await asyncio.wait(list(tasks), return_when = asyncio.FIRST_COMPLETED)
+                if len(raised) > 0:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions = True)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions = True)
+                raise
+            finally:
+                if threads is not None:
+                    threads.shutdown(wait = False, cancel_futures = True)
+        if len(raised) > 0:
+            raise raised[0]
+        return si
+
+    def _process_chunk(self, chunk, raise_errors = False):
+        """Process a list of (idx, row) tuples, count them in the reporter and return the number 
+        of clean and failed rows."""
+        clean = 0
+        errors = 0
+        for idx, row in chunk:
+            success, result = self._run_row(idx, row, raise_errors = raise_errors)
+            if success:
+                clean += 1
+                self.reporter.clean_increment()
+            else:
+                errors += 1
+                self.reporter.errors_increment()
+        return clean, errors
+
+    def _process_parallel(self, rows, raise_errors, n_workers, executor, chunksize, memory_budget = None):
+        """Send chunks of rows to a pool and merge the workers' timings into the reporter (the 
+        counters of the reporter are shared with the workers).
+        Only a limited number of chunks is in flight, so rows can be a generator. With a 
+        memory_budget, chunks are only submitted while the estimated memory of the chunks in 
+        flight (the largest row of each chunk, as a chunk is processed row by row) fits."""
+        if executor == 'process':
+            pool = cf.ProcessPoolExecutor(max_workers = n_workers,
+                                          mp_context = mp.get_context('fork'),
+                                          initializer = _pool_initializer,
+                                          initargs = (self,))
+            func = _pool_process_chunk
+        elif executor == 'thread':
+            pool = cf.ThreadPoolExecutor(max_workers = n_workers)
+            # timings are recorded directly in the shared reporter
+            func = lambda chunk, raise_errors: self._process_chunk(chunk, raise_errors) + ({},)
+        else:
+            raise ValueError(f'executor must be either "process" or "thread", got {executor}')
+
+        def merge(done):
+            for future in done:
+                pending.pop(future)
+                clean, errors, timings = future.result()
+                self.reporter.merge_timings(timings)
+                self._count_progress(clean + errors)
+
+        pending = {} # future: estimated memory
+        try:
+            for chunk in _chunked(rows, chunksize):
+                need = 0 if memory_budget is None else max(self.estimate_memory(row) for idx, row in chunk)
+                while len(pending) >= 2 * n_workers or (memory_budget is not None and len(pending) > 0 and sum(pending.values()) + need > memory_budget):
+                    done, _ = cf.wait(pending, return_when = cf.FIRST_COMPLETED)
+                    merge(done)
+                pending[pool.submit(func, chunk, raise_errors)] = need
+            done, _ = cf.wait(pending)
+            merge(done)
+        except BaseException:
+            pool.shutdown(wait = True, cancel_futures = True)
+            raise
+        pool.shutdown(wait = True)
+        return
+
     def get_last_row_before_workplan(self):
         try:
             idx = self.workplan.iloc[0].name
@@ -452,82 +1601,217 @@ class Workplanner():
         if loc < 0:
             print('Masterplan and Workplan are identical. Either this is the first time the script is run with this configuration or the start data needs to be adjusted')
             return None
-        return self.masterplan.iloc[loc]
+        return self._materialize(self.masterplan.iloc[[loc]]).iloc[0]
 
 
 class WorkplannerDaily(Workplanner):
+    def __init__(self, *args, incremental = False, **kwargs):
+        """
+        Workplanner that creates one output file per day from all input files 
+        that contribute to that day. See Workplanner for the parameters.
+
+        Parameters
+        ----------
+        incremental : bool, optional
+            If True, an incomplete day (the current day) is not rebuilt from all 
+            its input files on every run. Instead, process_row_increment is called 
+            with the existing partial output and only the input files that arrived 
+            since it was made. Which inputs went into an output is taken from the 
+            ledger, which therefore has to be set. Rows without a usable record 
+            (no ledger entry, reissued inputs, other product version) and 
+            subclasses that do not implement process_row_increment are processed 
+            in full by process_row. The default is False.
+        """
+        super().__init__(*args, **kwargs)
+        if incremental and self.ledger is None:
+            raise ValueError('incremental requires a ledger, which records the inputs of the partial outputs.')
+        self.incremental = incremental
+
     def _make_master(self):
         """This function tries to find all input files that can potendioally contribute to the output files of each day.
         This is done by looking at the last day befor and first day after the day in question.
         """
 
         # df = pd.DataFrame({'p2f_in': paths})
-        df = self._get_input_files()
+        try:
+            df = self._get_input_table()
+        except (ValueError, TypeError, IndexError) as e:
+            raise ValueError(f"Error parsing dates from file names. Make sure the Workplanner's date_from_name function (or date_regex) is defined and correct. Original error: {e}") from e
         if df.empty:
             self._masterplan = pd.DataFrame(columns=['p2f_in', 'p2f_out'])
             return self._masterplan
-        try:
-            file_names = [p.name for p in df.p2f_in.to_numpy()]
-            dates = [self.date_from_name(name) for name in file_names]
-            df.index = pd.to_datetime(dates)
-        except (ValueError, TypeError, IndexError) as e:
-            raise ValueError(f"Error parsing dates from file names, e.g {file_names[0]}. Make sure the Workplanner's date_from_name function is defined and correct. Original error: {e}") from e
         
-        df.sort_index(inplace=True)
         idx = df.index
-        mp = pd.DataFrame(index= pd.date_range(idx[0].normalize(), idx[-1].normalize(), freq='D'), columns=['p2f_in', 'p2f_out'])
+        mp = pd.DataFrame(index= pd.date_range(idx[0].normalize(), idx[-1].normalize(), freq='D'))
         # return df, wp
         if len(mp) == 0:
             self._masterplan = pd.DataFrame(columns=['p2f_in', 'p2f_out'])
             return self._masterplan
         
-        mp['p2f_out'] = mp.apply(lambda row: pl.Path(str(self.p2fld_out / self.output_file_format).format(date = row.name.strftime("%Y%m%d"), 
-                                                                                             year = row.name.strftime("%Y"),
-                                                                                             month = row.name.strftime("%m"),
-                                                                                             day = row.name.strftime("%d"),
-                                                                                             **self.kwargs)),
-                                                                                             axis = 1)
-
-        start_pos = df.index.searchsorted(mp.index, side='left') - 1
-        start_pos = [int(sp) if sp>= 0 else 0 for sp in start_pos]
-        end_pos = df.index.searchsorted(mp.index + pd.Timedelta(days=1), side='left')
-        idxmax = len(df)-1
-        end_pos =  [int(sp) if sp<= idxmax else idxmax for sp in end_pos]
+        if not self.compact_masterplan:
+            mp['p2f_out'] = self._output_paths(mp.index)
+
+        # The input files of each day are stored as offsets (CSR layout) into one shared path array: 
+        # day i gets the input files in_start[i]:in_stop[i]. The lists are only built for the rows 
+        # of the workplan (see _materialize).
+        start_pos = np.clip(idx.searchsorted(mp.index, side='left') - 1, 0, None)
+        end_pos = np.clip(idx.searchsorted(mp.index + pd.Timedelta(days=1), side='left'), None, len(df) - 1)
 
         self.tp_start_pos = start_pos
         self.tp_end_pos = end_pos
         self.tp_df = df
-        mp['p2f_in'] = [list(df.p2f_in.iloc[s:e + 1]) for s, e in zip(start_pos, end_pos)]
+        if self.compact_masterplan:
+            self._input_dirs = df.in_dir.array
+            self._input_names = df.in_name.to_numpy()
+        else:
+            self._input_paths = df.p2f_in.to_numpy()
+        mp['in_start'] = start_pos
+        mp['in_stop'] = end_pos + 1
 
         # check if an output file will be complete. It is complete if it contains an input file from the following day.
-        mp['day_complete'] = [list(df.iloc[s:e + 1].index) for s, e in zip(start_pos, end_pos)]
-        mp['day_complete'] = mp.apply(lambda row: row.name.normalize() < row.day_complete[-1].normalize(), axis = 1) #true if the last input file is at least from the following day.
+        mp['day_complete'] = mp.index.to_numpy() < idx.normalize().to_numpy()[end_pos] #true if the last input file is at least from the following day.
         self._masterplan = mp
+
+    def _input_slice(self, start, stop):
+        """List of the input files start:stop (CSR offsets of the masterplan)."""
+        if self.compact_masterplan:
+            return [pl.Path(d) / n for d, n in zip(self._input_dirs[start:stop], self._input_names[start:stop])]
+        return list(self._input_paths[start:stop])
+
+    def _materialize(self, df):
+        """Add the p2f_in column (list of input files per day) from the CSR offsets of the masterplan."""
+        if 'in_start' in df.columns:
+            df = df.copy()
+            df.insert(0, 'p2f_in', [self._input_slice(s, e) for s, e in zip(df.in_start, df.in_stop)])
+            df = df.drop(['in_start', 'in_stop'], axis = 1)
+        return super()._materialize(df)
+
+    def input_files(self, idx):
+        """The input files that contribute to the day idx of the masterplan."""
+        row = self.masterplan.loc[idx]
+        return self._input_slice(row.in_start, row.in_stop)
     
-    @property
-    def workplan(self):
+    def _iter_masterplan_batches(self):
+        """Streaming version of _make_master, yields the daily masterplan in pieces. Each day gets the 
+        last input file before the day, the files of the day and the first file of a later day."""
+        def make_batch(rows):
+            index = pd.DatetimeIndex([r[0] for r in rows])
+            return pd.DataFrame({'p2f_in': [r[1] for r in rows],
+                                 'p2f_out': self._output_paths(index),
+                                 'day_complete': [r[2] for r in rows]}, index = index)
+        prev = None     # last input file before the current day
+        day = None      # the current day
+        day_files = []  # input files of the current day
+        for batch in self._iter_input_batches():
+            rows = []
+            for date, p2f in zip(batch.index, batch.p2f_in):
+                d = date.normalize()
+                if day is None:
+                    day = d
+                if d > day:
+                    # first file of a later day, so the current day and the empty days in between are complete
+                    inputs = ([] if prev is None else [prev]) + day_files
+                    rows.append((day, inputs + [p2f], True))
+                    for empty_day in pd.date_range(day + pd.Timedelta(days = 1), d - pd.Timedelta(days = 1), freq = 'D'):
+                        rows.append((empty_day, [inputs[-1], p2f], True))
+                    prev = inputs[-1]
+                    day = d
+                    day_files = []
+                day_files.append(p2f)
+            if len(rows) > 0:
+                yield make_batch(rows)
+        if day is not None:
+            yield make_batch([(day, ([] if prev is None else [prev]) + day_files, False)])
+
+    def process_row_increment(self, row, partial, new_inputs, save = True):
+        """Update a partial output (incremental mode). Overwrite this in your subclass 
+        if the product can be extended by new data without rebuilding the whole day, 
+        e.g. by processing the new input files and concatenating the result to partial.
+        If not implemented, the row is processed in full by process_row.
+
+        Parameters
+        ----------
+        row : pandas.Series
+            The row of the workplan, as for process_row. row.p2f_in holds all inputs of the day.
+        partial : xarray.Dataset
+            The existing (incomplete) output file, loaded into memory.
+        new_inputs : list of pathlib.Path
+            Input files that did not contribute to partial yet.
+        save : bool, optional
+            Write the updated dataset to row.p2f_out (see write_output).
+
+        Example
+        -------
+        def process_row_increment(self, row, partial, new_inputs, save = True):
+            ds = self.raw2product(new_inputs)
+            ds = xr.concat([partial, ds], 'time')
+            ds = ds.sel(time = ~ds.indexes['time'].duplicated())
+            ds = ds.sel(time = slice(row.name, row.name + pd.Timedelta(days = 1)))
+            ds.attrs['day_complete'] = row.day_complete.__str__()
+            if save:
+                self.write_output(ds, row)
+            return ds
+        """
+        raise NotImplementedError
+
+    def _new_inputs(self, row):
+        """The inputs of row that are not in its partial output yet, None if the row can not be 
+        updated incrementally (no output or ledger record, inputs reissued, other product version)."""
+        if not os.path.isfile(row.p2f_out):
+            return None
+        record = self.ledger.lookup(row.p2f_out)
+        if record is None:
+            return None
+        recorded, version = record
+        product_version = getattr(self, 'version', None)
+        if product_version is not None and version != str(product_version):
+            return None
+        current = {fp[0]: fp for fp in prodledger.fingerprint(row.p2f_in)}
+        for fp in recorded:
+            if current.get(fp[0]) != fp:
+                return None
+        recorded = {fp[0] for fp in recorded}
+        return [p2f for p2f in row.p2f_in if str(p2f) not in recorded]
+
+    def _call_process_row(self, row, save = True):
+        # only subclasses that implement the hook can be updated incrementally
+        implemented = type(self).process_row_increment is not WorkplannerDaily.process_row_increment
+        if not self.incremental or not implemented:
+            return super()._call_process_row(row, save = save)
+        new_inputs = self._new_inputs(row)
+        if new_inputs is None:
+            return super()._call_process_row(row, save = save)
+        with xr.open_dataset(row.p2f_out) as ds:
+            partial = ds.load()
+        if len(new_inputs) == 0:
+            # nothing arrived since the partial output was made
+            return partial
+        return self.process_row_increment(row, partial, new_inputs, save = save)
+
+    def _check_existing_run(self, run):
+        """Only the newest existing file is checked for completeness (see workplan)."""
+        if len(run) == 0:
+            return []
+        idx, row = run[-1]
+        if self._day_complete(row.p2f_out):
+            return []
+        if self.verbose:
+            print(f'Output file {row.p2f_out} is not complete and will be re-processed.')
+        return [(idx, row)]
+
+    def _make_workplan(self):
         wp = self.masterplan.dropna()
-        where = wp.apply(lambda row: row.p2f_out.is_file(), axis = 1)
+        where = self._outputs_done(wp)
         self.tp_where = where.copy()
         if where.any():
             last_idx = where[where].index[-1]
-            last_row = wp.loc[last_idx]
-            with xr.open_dataset(last_row.p2f_out) as dst:
-                dst = xr.open_dataset(last_row.p2f_out)
-                self.tp_dst = dst.copy()
-                if 'day_complete' not in dst.attrs:
-                    raise AttributeError(f'File complete check is enabled, but the day_complete attribute is missing in last processed file {last_row.p2f_out}. Add "attrs["day_complete"] = row.day_complete.__str__()" to the process_row method of your Workplanner subclass to fix this. You will also need to remove the previous file or somehow add the attribute to it.')
-                dc = dst.day_complete.strip().lower()
-                assert(dc in ['true','false']), f'day_complete needs to be True or False, found {dc}.'
-                dc = dc == 'true'
+            last_p2f_out = self._output_paths([last_idx])[0]
+            dc = self._day_complete(last_p2f_out)
+            self.attribute_cache.save()
             if not dc:
                 if self.verbose:
-                    print(f'Output file {last_row.p2f_out} is not complete and will be re-processed.')
+                    print(f'Output file {last_p2f_out} is not complete and will be re-processed.')
                 where.loc[last_idx] = False
 
         wp = wp[~where]
         return wp
-    
-    @workplan.setter
-    def workplan(self, workplan):
-        self._workplan = workplan
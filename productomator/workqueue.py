@@ -0,0 +1,131 @@
+import pathlib as pl
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import contextlib
+
+
+class LeaseQueue(object):
+    def __init__(self, path2queue, lease_time = 600, owner = None):
+        """
+        Work queue (SQLite) that lets several runs of the same product, e.g.
+        overlapping cron jobs or runs on several servers with a shared file
+        system, split the workplan between them. A row is only processed by
+        the run that claimed it. Claims are leases that expire after
+        lease_time seconds unless they are renewed (see heartbeat), so rows
+        of a run that died are taken over by the others.
+
+        Parameters
+        ----------
+        path2queue : str or pathlib.Path
+            Path to the SQLite file. All runs that should cooperate need to
+            use the same file.
+        lease_time : float, optional
+            Time in seconds after which a claim that was not renewed expires.
+            The default is 600.
+        owner : str, optional
+            Identifies this run in the queue. By default, host name, process
+            id and a random suffix.
+        """
+        self.path2queue = pl.Path(path2queue)
+        self.path2queue.parent.mkdir(parents = True, exist_ok = True)
+        self.lease_time = lease_time
+        if owner is None:
+            owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.owner = owner
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rows ('
+                         'key TEXT PRIMARY KEY, '
+                         'status TEXT, '        # pending, leased or done
+                         'owner TEXT, '
+                         'lease_until REAL, '
+                         'finished REAL)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path2queue, timeout = 60, isolation_level = None)
+        return contextlib.closing(conn)
+
+    def claim(self, key, planned = None):
+        """
+        Try to lease the row key. Succeeds if nobody else holds a valid lease
+        and the row was not done after planned.
+
+        Parameters
+        ----------
+        key : str
+        planned : float, optional
+            Time (epoch seconds) at which the caller decided that the row
+            needs processing. Rows that were marked done before that are
+            processed again (e.g. an incomplete day or changed inputs), rows
+            that were done after it are skipped. If None, done rows are skipped.
+
+        Returns
+        -------
+        bool
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute("INSERT OR IGNORE INTO rows VALUES (?, 'pending', NULL, NULL, NULL)", (key,))
+                if planned is not None:
+                    conn.execute("UPDATE rows SET status = 'pending' WHERE key = ? AND status = 'done' AND finished < ?", (key, planned))
+                cur = conn.execute("UPDATE rows SET status = 'leased', owner = ?, lease_until = ? "
+                                   "WHERE key = ? AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))",
+                                   (self.owner, now + self.lease_time, key, now))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return cur.rowcount == 1
+
+    def renew(self):
+        """Extend all leases held by this owner."""
+        with self._connect() as conn:
+            conn.execute("UPDATE rows SET lease_until = ? WHERE owner = ? AND status = 'leased'",
+                         (time.time() + self.lease_time, self.owner))
+
+    def done(self, key):
+        """Mark a leased row as done."""
+        with self._connect() as conn:
+            conn.execute("UPDATE rows SET status = 'done', finished = ? WHERE key = ? AND owner = ?",
+                         (time.time(), key, self.owner))
+
+    def release(self, key):
+        """Give a leased row back (e.g. after an error), so other runs can claim it."""
+        with self._connect() as conn:
+            conn.execute("UPDATE rows SET status = 'pending', owner = NULL, lease_until = NULL WHERE key = ? AND owner = ? AND status = 'leased'",
+                         (key, self.owner))
+
+    def status(self):
+        """Number of rows per status."""
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM rows GROUP BY status').fetchall())
+
+    @contextlib.contextmanager
+    def heartbeat(self, interval = None):
+        """
+        Renew the leases of this owner in a background thread every interval
+        seconds (default lease_time / 3) while the context is open. Leases of
+        rows processed in forked worker processes are renewed as well, as they
+        share the owner.
+        """
+        if interval is None:
+            interval = self.lease_time / 3
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except sqlite3.OperationalError as e:
+                    print(f'Warning: renewing the leases failed ({e}).')
+        thread = threading.Thread(target = beat, daemon = True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()